@@ -0,0 +1,331 @@
+"""Read-only HTTP JSON API for partner apps that poll for food.
+
+Serves the same query catalog and listing filters as the Streamlit app,
+without rerunning a script per request:
+
+    GET /queries                         catalog query names and their paths
+    GET /queries/{name}[?city=...]       one catalog query's rows
+    GET /listings?location=&provider=&food_type=&after_id=&limit=
+                                         a page of the Filter & Contact listing filter
+    GET /listings/open?city=&quantity=&limit=
+                                         open listings, soonest-expiring first
+    GET /export/tables/{table}.{format}  a whole table, streamed (csv, csv.gz, parquet)
+    GET /export/queries/{name}.{format}  a catalog query, streamed
+    GET /health
+
+Handlers are async; database work runs on a thread pool against the shared,
+pooled engines from db.py, so the pool size bounds concurrent queries.
+
+Every response carries an ETag and Last-Modified derived from the change
+versions of the tables it reads (see versions.py). The versions are read at
+most once every ``FOODWASTE_API_VERSION_TTL`` seconds (default 1), and
+response bodies are cached per URL and version, so a poll for unchanged
+data is answered from memory, or with 304 Not Modified when the client
+sends If-None-Match / If-Modified-Since, without touching the database.
+
+Usage:
+    python api.py [--host 127.0.0.1] [--port 8000] [--url URL]
+    uvicorn api:app --workers 4        # same app, several processes
+
+Needs starlette and uvicorn. ``python bench.py api`` load-tests a running server.
+"""
+import argparse
+import collections
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import threading
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import db
+import export
+import listings
+import matching
+import metrics
+import schema
+import versions
+
+VERSION_TTL = float(os.environ.get("FOODWASTE_API_VERSION_TTL", "1"))
+CACHE_ENTRIES = int(os.environ.get("FOODWASTE_API_CACHE_ENTRIES", "256"))
+MAX_LIMIT = 500
+
+TABLES = [t.name for t in schema.TABLES]
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ResponseCache:
+    """Encoded bodies keyed by URL and ETag, least recently used evicted first."""
+
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _engines(request):
+    state = request.app.state
+    return state.engine or db.get_engine(), state.analytics_engine or db.get_analytics_engine()
+
+
+def _validators(request, tables, day=None):
+    """``(etag, last_modified)`` for a response built from ``tables``.
+
+    ``day`` is set for answers that also depend on today's date.
+    """
+    engine, _ = _engines(request)
+    current = versions.current(engine, VERSION_TTL)
+    changed = [current.get(t, (0, datetime.datetime(1970, 1, 1))) for t in tables]
+    last_modified = max(updated for _, updated in changed)
+    if day is not None:
+        last_modified = max(last_modified, datetime.datetime.combine(day, datetime.time()))
+    tag = repr((request.url.path, sorted(request.query_params.multi_items()), day,
+                [(t, v[0], v[1].isoformat()) for t, v in zip(tables, changed)]))
+    etag = '"' + hashlib.sha1(tag.encode()).hexdigest()[:20] + '"'
+    return etag, last_modified
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*"
+    since = request.headers.get("if-modified-since")
+    if since:
+        try:
+            since = email.utils.parsedate_to_datetime(since).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def _headers(etag, last_modified):
+    return {
+        "ETag": etag,
+        "Last-Modified": email.utils.format_datetime(
+            last_modified.replace(tzinfo=datetime.timezone.utc), usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+
+async def _cached(request, tables, build, day=None):
+    """A JSON response for ``build()``, served from the cache while ``tables`` are unchanged."""
+    etag, last_modified = await run_in_threadpool(_validators, request, tables, day)
+    headers = _headers(etag, last_modified)
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    cache = request.app.state.cache
+    key = (str(request.url), etag)
+    body = cache.get(key)
+    if body is None:
+        body = await run_in_threadpool(_encode, build)
+        cache.put(key, body)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _encode(build):
+    body = json.dumps(build(), default=str, separators=(",", ":")).encode()
+    metrics.maybe_export()
+    return body
+
+
+def _rows(frame):
+    return json.loads(frame.to_json(orient="records", date_format="iso"))
+
+
+def _int(request, name, default, low=0, high=None):
+    value = request.query_params.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+    if value < low or (high is not None and value > high):
+        raise ApiError(400, f"{name} must be between {low} and {high}" if high else f"{name} must be >= {low}")
+    return value
+
+
+def _catalog(request):
+    """``{slug: (name, sql)}`` for the catalog queries."""
+    engine, _ = _engines(request)
+    return {export.slug(name): (name, sql) for name, sql in export.catalog(engine).items()}
+
+
+def _query(request, slug):
+    """``(name, sql, params, tables, engine)`` for the catalog query at ``slug``."""
+    engine, analytics_engine = _engines(request)
+    found = _catalog(request).get(slug)
+    if found is None:
+        raise ApiError(404, f"unknown query {slug!r}")
+    name, sql = found
+    if name == export.CONTACTS_QUERY:
+        city = request.query_params.get("city")
+        if not city:
+            raise ApiError(400, "city is required for this query")
+        return name, sql, {"city": city}, ["providers"], engine
+    # Summary-table answers change with every base table, so depend on all of them.
+    return name, sql, None, TABLES, analytics_engine
+
+
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def query_list(request):
+    catalog = await run_in_threadpool(_catalog, request)
+    return JSONResponse([
+        {"name": name, "path": f"/queries/{slug}",
+         "params": ["city"] if name == export.CONTACTS_QUERY else []}
+        for slug, (name, _) in catalog.items()
+    ])
+
+
+async def query_rows(request):
+    name, sql, params, tables, engine = await run_in_threadpool(
+        _query, request, request.path_params["name"])
+
+    def build():
+        with metrics.view(f"api / {name}"):
+            return {"query": name, "rows": _rows(metrics.read_sql(sql, engine, params=params))}
+
+    return await _cached(request, tables, build)
+
+
+async def listing_page(request):
+    engine, _ = _engines(request)
+    filters = {f: request.query_params.get(f) or None for f in ("location", "provider", "food_type")}
+    after_id = _int(request, "after_id", 0)
+    limit = _int(request, "limit", listings.PAGE_SIZE, 1, MAX_LIMIT)
+
+    def build():
+        with metrics.view("api / listings"):
+            page, has_more = listings.listings_page(engine, **filters, after_id=after_id, limit=limit)
+        return {
+            "rows": _rows(page),
+            "has_more": has_more,
+            "next_after_id": int(page["Food_ID"].iloc[-1]) if has_more else None,
+        }
+
+    return await _cached(request, ["food_listings", "providers"], build)
+
+
+async def open_listings(request):
+    engine, _ = _engines(request)
+    city = request.query_params.get("city") or None
+    quantity = _int(request, "quantity", 1, 1)
+    limit = _int(request, "limit", listings.PAGE_SIZE, 1, MAX_LIMIT)
+    today = datetime.date.today()
+
+    def build():
+        with metrics.view("api / open listings"):
+            frame = matching.open_listings(engine, city, quantity, today, limit)
+        return {"as_of": today.isoformat(), "rows": _rows(frame)}
+
+    # Listings expire at midnight without any write, so the date is part of the version.
+    return await _cached(request, ["food_listings"], build, day=today)
+
+
+def _format(request):
+    name, _, fmt = request.path_params["file"].partition(".")
+    if fmt not in export.FORMATS:
+        raise ApiError(404, f"unknown format {fmt!r}; use one of {', '.join(export.FORMATS)}")
+    return name, fmt
+
+
+async def _streamed(request, name, fmt, sql, params, tables, engine, columns=None):
+    etag, last_modified = await run_in_threadpool(_validators, request, tables)
+    headers = _headers(etag, last_modified)
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="{export.file_name(name, fmt)}"'
+    pieces = export.stream(engine, sql, fmt, params, view_name=f"api / export {name}", columns=columns)
+    return StreamingResponse(pieces, media_type=export.FORMATS[fmt][1], headers=headers)
+
+
+async def export_table(request):
+    table, fmt = _format(request)
+    if table not in TABLES:
+        raise ApiError(404, f"unknown table {table!r}")
+    engine, _ = _engines(request)
+    return await _streamed(request, table, fmt, export.table_sql(table), None, [table], engine,
+                           export.table_columns(table))
+
+
+async def export_query(request):
+    slug, fmt = _format(request)
+    name, sql, params, tables, engine = await run_in_threadpool(_query, request, slug)
+    return await _streamed(request, name, fmt, sql, params, tables, engine)
+
+
+async def api_error(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=exc.status)
+
+
+def create_app(engine=None, analytics_engine=None):
+    """The API app; engines default to the shared ones from db.py, created on first use."""
+    app = Starlette(
+        routes=[
+            Route("/health", health),
+            Route("/queries", query_list),
+            Route("/queries/{name}", query_rows),
+            Route("/listings", listing_page),
+            Route("/listings/open", open_listings),
+            Route("/export/tables/{file}", export_table),
+            Route("/export/queries/{file}", export_query),
+        ],
+        exception_handlers={ApiError: api_error},
+    )
+    app.state.engine = engine
+    app.state.analytics_engine = analytics_engine
+    app.state.cache = ResponseCache()
+    return app
+
+
+app = create_app()
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the read-only HTTP JSON API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--url", help="SQLAlchemy database URL (default: the backend configured in db.py)")
+    args = parser.parse_args(argv)
+
+    engine = db.create_db_engine(args.url) if args.url else None
+    uvicorn.run(create_app(engine, engine), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
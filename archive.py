@@ -0,0 +1,316 @@
+"""Move expired listings and their finished claims out of the hot tables.
+
+The sweeper moves listings whose Expiry_Date is more than ``retention``
+days in the past, together with their claims, into ``food_listings_archive``
+and ``claims_archive``. A listing that still has a claim which is not
+Completed or Cancelled stays where it is until that claim is settled. Rows
+are moved in batches of ``batch_size`` listings, one short transaction per
+batch, with a ``pause`` between batches so live writes are never held up
+for long.
+
+Each batch updates the summary tables like a delete, so the "15 Queries"
+catalog describes the hot tables. The time rollups behind the Trends view
+count history, so they keep the archived rows; rollups.py reads the
+``food_listings_all`` and ``claims_all`` views (hot UNION ALL archive) when
+it rebuilds. :func:`with_history` rewrites a catalog query to read those
+views as well.
+
+Archived IDs stay unique: while the archive exists, new listings and claims
+on SQLite get a key above both the hot and the archived rows (see
+:func:`insert_sql`), and ``loader.py --mode upsert`` skips rows whose key is
+already archived.
+
+Usage:
+    python archive.py sweep [--url URL] [--retention-days 30] [--batch-size 500] [--pause 0.2]
+    python archive.py run [--interval 3600] ...   # sweep periodically, in the background
+    python archive.py create [--url URL]          # only create the archive tables and views
+"""
+import argparse
+import collections
+import datetime
+import re
+import time
+
+from sqlalchemy import Column, DateTime, MetaData, Table, bindparam, inspect, text
+
+import db
+import metrics
+import schema
+import search
+import summaries
+import table_cache
+import versions
+
+metadata = MetaData()
+
+RETENTION_DAYS = 30
+BATCH_SIZE = 500
+PAUSE = 0.2
+INTERVAL = 3600
+
+FINISHED = ("Completed", "Cancelled")
+
+# hot table -> (archive table, hot + archive view)
+ARCHIVED = {
+    "food_listings": ("food_listings_archive", "food_listings_all"),
+    "claims": ("claims_archive", "claims_all"),
+}
+
+SweepResult = collections.namedtuple("SweepResult", "listings claims batches seconds")
+
+
+def _archive_table(source):
+    columns = [Column(c.name, c.type, primary_key=c.primary_key) for c in source.columns]
+    return Table(ARCHIVED[source.name][0], metadata, *columns, Column("Archived_At", DateTime))
+
+
+food_listings_archive = _archive_table(schema.food_listings)
+claims_archive = _archive_table(schema.claims)
+
+_enabled = {}
+
+
+def enabled(engine):
+    """Whether the archive tables exist.
+
+    Only a yes is kept (per engine and process): the sweeper may create the
+    tables from another process at any time.
+    """
+    key = str(engine.url)
+    if not _enabled.get(key):
+        _enabled[key] = all(inspect(engine).has_table(t) for t in metadata.tables)
+    return _enabled[key]
+
+
+def _columns(table):
+    return ", ".join(c.name for c in schema.metadata.tables[table].columns)
+
+
+def create(engine):
+    """Create the archive tables and the hot + archive views if they are missing."""
+    metadata.create_all(engine)
+    sqlite_ = engine.dialect.name == "sqlite"
+    with engine.begin() as conn:
+        for table, (archive_table, view) in ARCHIVED.items():
+            columns = _columns(table)
+            # SQLite has no CREATE OR REPLACE VIEW; recreating keeps the columns current.
+            if sqlite_:
+                metrics.execute(conn, f"DROP VIEW IF EXISTS {view}")
+            metrics.execute(conn, f"{'CREATE' if sqlite_ else 'CREATE OR REPLACE'} VIEW {view} AS "
+                                  f"SELECT {columns} FROM {table} UNION ALL SELECT {columns} FROM {archive_table}")
+    _enabled[str(engine.url)] = True
+
+
+def _in(sql):
+    return text(sql).bindparams(bindparam("ids", expanding=True))
+
+
+def _key(table):
+    return list(schema.metadata.tables[table].primary_key)[0].name
+
+
+def insert_sql(engine, table, columns):
+    """``INSERT`` of one ``table`` row from ``:column`` parameters, the key left to the database.
+
+    SQLite gives a new row MAX + 1 of the keys in the table, which is an
+    archived row's key once the newest rows were swept. While the archive
+    exists, food_listings and claims rows there get MAX + 1 over the hot and
+    the archived keys instead, in the same statement, so it runs under the
+    write lock. PostgreSQL sequences and MySQL's AUTO_INCREMENT never go back.
+    """
+    values = ", ".join(":" + c for c in columns)
+    if table not in ARCHIVED or engine.dialect.name != "sqlite" or not enabled(engine):
+        return text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({values})")
+    key, archive_table = _key(table), ARCHIVED[table][0]
+    return text(
+        f"INSERT INTO {table} ({key}, {', '.join(columns)}) "
+        f"SELECT COALESCE(MAX(k), 0) + 1, {values} FROM "
+        f"(SELECT MAX({key}) AS k FROM {table} UNION ALL SELECT MAX({key}) FROM {archive_table}) AS keys"
+    )
+
+
+def archived_keys(conn, table, keys):
+    """The keys among ``keys`` that ``table``'s archive holds (none without an archive)."""
+    if table not in ARCHIVED or not enabled(conn.engine):
+        return set()
+    keys, key, found = list(keys), _key(table), set()
+    for start in range(0, len(keys), BATCH_SIZE):
+        found.update(int(k) for k in metrics.execute(
+            conn, _in(f"SELECT {key} FROM {ARCHIVED[table][0]} WHERE {key} IN :ids"),
+            {"ids": keys[start:start + BATCH_SIZE]}).scalars())
+    return found
+
+
+def drop(engine):
+    """Drop the hot + archive views and the archive tables, with every archived row."""
+    with engine.begin() as conn:
+        for _, view in ARCHIVED.values():
+            metrics.execute(conn, f"DROP VIEW IF EXISTS {view}")
+    metadata.drop_all(engine)
+    _enabled.pop(str(engine.url), None)
+
+
+def history(engine, table):
+    """The view holding ``table``'s hot and archived rows, or ``table`` without an archive."""
+    if table in ARCHIVED and enabled(engine):
+        return ARCHIVED[table][1]
+    return table
+
+
+def with_history(sql):
+    """``sql`` reading the hot + archive views instead of food_listings and claims."""
+    for table, (_, view) in ARCHIVED.items():
+        sql = re.sub(rf"\b{table}\b", view, sql)
+    return sql
+
+
+# A listing may move once it expired before the cutoff and every claim on it
+# is settled. One whose key, or a claim's key, is archived already (a hot row
+# loaded again after a sweep) stays, rather than failing the whole batch.
+_MOVABLE = f"""
+    f.Expiry_Date < :cutoff
+    AND NOT EXISTS (
+        SELECT 1 FROM claims c WHERE c.Food_ID = f.Food_ID
+        AND (c.Status IS NULL OR c.Status NOT IN ({", ".join(f"'{s}'" for s in FINISHED)}))
+    )
+    AND NOT EXISTS (SELECT 1 FROM food_listings_archive a WHERE a.Food_ID = f.Food_ID)
+    AND NOT EXISTS (
+        SELECT 1 FROM claims c JOIN claims_archive a ON a.Claim_ID = c.Claim_ID WHERE c.Food_ID = f.Food_ID
+    )
+"""
+
+
+def candidates(engine, cutoff, after_id=0, limit=BATCH_SIZE):
+    """Food_IDs of up to ``limit`` movable listings above ``after_id``, in order."""
+    frame = metrics.read_sql(
+        f"SELECT f.Food_ID FROM food_listings f WHERE f.Food_ID > :after_id AND {_MOVABLE} "
+        "ORDER BY f.Food_ID LIMIT :limit",
+        engine, params={"after_id": int(after_id), "cutoff": cutoff, "limit": int(limit)},
+        view_name="archive candidates",
+    )
+    return [int(i) for i in frame["Food_ID"]]
+
+
+def move(engine, food_ids, cutoff):
+    """Archive the given listings and their claims in one transaction.
+
+    Listings that are no longer movable (a claim came in meanwhile) are left
+    alone. Returns ``(listing ids moved, claim ids moved)``.
+    """
+    now = datetime.datetime.now().replace(microsecond=0)
+    listing_columns, claim_columns = _columns("food_listings"), _columns("claims")
+    with metrics.view("archive sweep"), engine.begin() as conn:
+        archived = _archived(conn, food_ids)
+        # Copying is the first write, so the transaction starts as a writer
+        # and the movability check cannot go stale before the rows are deleted.
+        metrics.execute(conn, _in(
+            f"INSERT INTO food_listings_archive ({listing_columns}, Archived_At) "
+            f"SELECT {listing_columns}, :now FROM food_listings f WHERE f.Food_ID IN :ids AND {_MOVABLE}"
+        ), {"ids": list(food_ids), "cutoff": cutoff, "now": now})
+        moved = sorted(_archived(conn, food_ids) - archived)
+        if not moved:
+            return [], []
+        listings = [dict(r) for r in metrics.execute(
+            conn, _in("SELECT * FROM food_listings WHERE Food_ID IN :ids"), {"ids": moved}).mappings()]
+        claims = [dict(r) for r in metrics.execute(
+            conn, _in("SELECT * FROM claims WHERE Food_ID IN :ids"), {"ids": moved}).mappings()]
+        if claims:
+            metrics.execute(conn, _in(
+                f"INSERT INTO claims_archive ({claim_columns}, Archived_At) "
+                f"SELECT {claim_columns}, :now FROM claims WHERE Food_ID IN :ids"
+            ), {"ids": moved, "now": now})
+
+        def delete(table):
+            def write():
+                return metrics.execute(conn, _in(f"DELETE FROM {table} WHERE Food_ID IN :ids"),
+                                       {"ids": moved}).rowcount, []
+            return write
+
+        track = summaries.enabled(engine)
+        for table, rows in (("claims", claims), ("food_listings", listings)):
+            if track:
+                summaries.apply_batch(conn, table, rows, [], delete(table), archived=True)
+            else:
+                delete(table)()
+    claim_ids = [c["Claim_ID"] for c in claims]
+    for table in ("claims", "food_listings"):
+        table_cache.invalidate(table)
+    versions.bump(engine, "food_listings", "claims")
+    for table, keys in (("claims", claim_ids), ("food_listings", moved)):
+        search.refresh(engine, table, keys)
+    return moved, claim_ids
+
+
+def _archived(conn, food_ids):
+    return {int(i) for i in metrics.execute(
+        conn, _in("SELECT Food_ID FROM food_listings_archive WHERE Food_ID IN :ids"), {"ids": list(food_ids)}
+    ).scalars()}
+
+
+def sweep(engine, retention_days=RETENTION_DAYS, batch_size=BATCH_SIZE, pause=PAUSE,
+          max_batches=None, today=None):
+    """Archive every movable listing, ``batch_size`` at a time; returns a SweepResult.
+
+    Listings are movable once their Expiry_Date is more than
+    ``retention_days`` before ``today`` (default: the current date).
+    """
+    if not enabled(engine):
+        create(engine)
+    cutoff = (today or datetime.date.today()) - datetime.timedelta(days=retention_days)
+    started = time.perf_counter()
+    listings = claims = batches = 0
+    after_id = 0
+    while max_batches is None or batches < max_batches:
+        food_ids = candidates(engine, cutoff, after_id, batch_size)
+        if not food_ids:
+            break
+        moved, claim_ids = move(engine, food_ids, cutoff)
+        listings += len(moved)
+        claims += len(claim_ids)
+        batches += 1
+        after_id = food_ids[-1]
+        if len(food_ids) < batch_size:
+            break
+        time.sleep(pause)
+    return SweepResult(listings, claims, batches, time.perf_counter() - started)
+
+
+def counts(engine):
+    """``{table: (hot rows, archived rows)}`` for food_listings and claims."""
+    found = {}
+    for table, (archive_table, _) in ARCHIVED.items():
+        sql = f"SELECT (SELECT COUNT(*) FROM {table}) AS hot"
+        if enabled(engine):
+            sql += f", (SELECT COUNT(*) FROM {archive_table}) AS archived"
+        row = metrics.read_sql(sql, engine, view_name="archive counts").iloc[0]
+        found[table] = (int(row["hot"]), int(row.get("archived", 0)))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive expired listings and their finished claims.")
+    parser.add_argument("command", choices=("sweep", "run", "create"))
+    parser.add_argument("--url", help="SQLAlchemy database URL (default: the backend configured in db.py)")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS,
+                        help="keep listings this many days past their expiry date")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="listings moved per transaction")
+    parser.add_argument("--pause", type=float, default=PAUSE, help="seconds to wait between batches")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="run: seconds between sweeps")
+    args = parser.parse_args(argv)
+
+    engine = db.create_db_engine(args.url)
+    if args.command == "create":
+        create(engine)
+        print("archive tables and views ready")
+        return
+    while True:
+        result = sweep(engine, args.retention_days, args.batch_size, args.pause)
+        print(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} archived {result.listings} listings and "
+              f"{result.claims} claims in {result.batches} batches ({result.seconds:.1f}s)", flush=True)
+        if args.command == "sweep":
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""Benchmark the query catalog, the Filter & Contact path and the CRUD actions.
+
+Usage:
+    python bench.py [--url URL] [--repeat 20] [--out bench_results.json]
+                    [--baseline baseline.json] [--save-baseline] [--threshold 1.25]
+    python bench.py matching [--url URL] [--workers 8] [--claims 2000] [--quantity 1]
+    python bench.py api [--base-url http://127.0.0.1:8000] [--workers 8] [--seconds 10]
+                        [--no-revalidate]
+
+Each case is run ``--repeat`` times for latency percentiles, then once more
+under tracemalloc for peak Python memory. Results are written as JSON. With
+``--baseline`` the run is compared against an earlier results file and the
+command exits with status 1 if any case's p50 grew by more than
+``--threshold``; ``--save-baseline`` writes the results there instead.
+
+CRUD cases insert, update and delete their own rows, leaving the data as
+they found it. Use a generated dataset (see datagen.py) to benchmark at scale.
+
+``matching`` measures claim throughput under contention: ``--workers``
+threads claim from the city with the most listings at the same time. It
+then checks that no listing gave out more than it held, and deletes its
+claims afterwards, which gives the quantities back.
+
+``api`` load-tests a running ``api.py``: ``--workers`` threads poll the
+catalog and listing endpoints for ``--seconds``, then requests per second,
+latency percentiles and the count of each status (304 for unchanged data)
+are reported.
+"""
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import http.client
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import urllib.parse
+import urllib.request
+
+from sqlalchemy import text
+
+import crud
+import db
+import listings
+import matching
+import metrics
+import query_catalog
+import search
+import summaries
+
+
+def _sample(engine, sql):
+    with engine.connect() as conn:
+        return conn.execute(text(sql)).scalar()
+
+
+def query_cases(engine, analytics_engine):
+    cases = {}
+    for name, sql in query_catalog.QUERIES.items():
+        if sql is None:
+            continue
+        cases[f"query: {name}"] = lambda sql=sql: metrics.read_sql(sql, analytics_engine)
+    if summaries.enabled(engine):
+        for name, sql in query_catalog.SUMMARY_QUERIES.items():
+            cases[f"summary: {name}"] = lambda sql=sql: metrics.read_sql(sql, analytics_engine)
+    city = _sample(engine, "SELECT City FROM providers ORDER BY Provider_ID LIMIT 1")
+    cases["query: Provider contact info by city"] = lambda: metrics.read_sql(
+        query_catalog.PROVIDER_CONTACTS_BY_CITY, engine, params={"city": city})
+    return cases
+
+
+def filter_cases(engine):
+    location = _sample(engine, "SELECT Location FROM food_listings ORDER BY Food_ID LIMIT 1")
+    provider = _sample(engine, "SELECT Name FROM providers ORDER BY Provider_ID LIMIT 1")
+    middle = _sample(engine, "SELECT MAX(Food_ID) / 2 FROM food_listings") or 0
+
+    def suggest_cold():
+        # Measure building the index from the database, not the shared one.
+        search.reset()
+        search.suggest(engine, "food_listings", "Location", "")
+
+    def suggest_warm():
+        search.suggest(engine, "food_listings", "Location", location[:3])
+        search.suggest(engine, "providers", "Name", provider[:3])
+
+    def page_with_contacts(**filters):
+        page, _ = listings.listings_page(engine, **filters)
+        ids = page["Food_ID"].tolist()
+        listings.provider_contacts(engine, ids)
+        listings.receiver_contacts(engine, ids)
+
+    return {
+        "filter: suggest (cold index)": suggest_cold,
+        "filter: suggest (warm index)": suggest_warm,
+        "filter: first page": lambda: page_with_contacts(),
+        "filter: deep page": lambda: page_with_contacts(after_id=middle),
+        "filter: by location": lambda: page_with_contacts(location=location),
+        "filter: by provider": lambda: page_with_contacts(provider=provider),
+    }
+
+
+def crud_cases(engine):
+    provider_id = _sample(engine, "SELECT MIN(Provider_ID) FROM providers")
+    receiver_id = _sample(engine, "SELECT MIN(Receiver_ID) FROM receivers")
+    food_id = _sample(engine, "SELECT MIN(Food_ID) FROM food_listings")
+    today = datetime.date.today()
+    rows = {
+        "providers": {"Name": "Bench Provider", "Type": "Restaurant", "Address": "1 Bench Road",
+                      "City": "Benchville", "Contact": "000-000-0000"},
+        "receivers": {"Name": "Bench Receiver", "Type": "NGO", "City": "Benchville",
+                      "Contact": "000-000-0000"},
+        "food_listings": {"Food_Name": "Bread", "Quantity": 10, "Expiry_Date": today,
+                          "Provider_ID": provider_id, "Provider_Type": "Restaurant",
+                          "Location": "Benchville", "Food_Type": "Vegetarian", "Meal_Type": "Lunch"},
+        # No Quantity, so the claim cases leave the listing's stock alone.
+        "claims": {"Food_ID": food_id, "Receiver_ID": receiver_id, "Quantity": None,
+                   "Status": "Pending", "Timestamp": datetime.datetime.now().replace(microsecond=0)},
+    }
+
+    # Rows added by the "add" cases are updated and then deleted by the
+    # cases that follow, so every action is timed on its own.
+    added = {table: [] for table in rows}
+
+    def add(table):
+        added[table].append(crud.insert(engine, table, rows[table]))
+
+    def own_row(table):
+        if not added[table]:
+            add(table)
+        return added[table][-1]
+
+    def update(table):
+        crud.update(engine, table, own_row(table), rows[table])
+
+    def delete(table):
+        crud.delete(engine, table, own_row(table))
+        added[table].pop()
+
+    cases = {}
+    for table in rows:
+        cases[f"crud: {table} add"] = lambda t=table: add(t)
+        cases[f"crud: {table} update"] = lambda t=table: update(t)
+        cases[f"crud: {table} delete"] = lambda t=table: delete(t)
+    return cases
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_case(fn, repeat):
+    fn()  # warm-up: connection checkout, statement caches
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings.sort()
+    return {
+        "runs": repeat,
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "max_ms": round(timings[-1], 3),
+        "peak_mem_kib": round(peak / 1024, 1),
+    }
+
+
+def table_sizes(engine):
+    return {t: _sample(engine, f"SELECT COUNT(*) FROM {t}") for t in crud.TABLES}
+
+
+def compare(results, baseline, threshold):
+    """Return ``(case, baseline p50, current p50)`` for every regressed case."""
+    regressions = []
+    for case, current in results["cases"].items():
+        before = baseline.get("cases", {}).get(case)
+        if before and before["p50_ms"] > 0 and current["p50_ms"] / before["p50_ms"] > threshold:
+            regressions.append((case, before["p50_ms"], current["p50_ms"]))
+    return regressions
+
+
+def matching_benchmark(engine, workers, claims, quantity=1):
+    """Claim concurrently from the busiest city; returns throughput and contention stats."""
+    # Count every listing as open, whatever the dates in the dataset.
+    as_of = _sample(engine, "SELECT MIN(Expiry_Date) FROM food_listings")
+    city = _sample(engine, "SELECT Location FROM food_listings GROUP BY Location "
+                           "ORDER BY COUNT(*) DESC, Location LIMIT 1")
+    receiver_ids = metrics.read_sql("SELECT Receiver_ID FROM receivers", engine)["Receiver_ID"].tolist()
+    before = dict(metrics.read_sql("SELECT Food_ID, Quantity FROM food_listings", engine).values.tolist())
+
+    def one(i):
+        start = time.perf_counter()
+        allocation = matching.claim(engine, receiver_ids[i % len(receiver_ids)], quantity,
+                                    city=city, as_of=as_of)
+        return allocation, (time.perf_counter() - start) * 1000
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(one, range(claims)))
+    elapsed = time.perf_counter() - started
+
+    allocated = [a for a, _ in results if a.claim_id is not None]
+    after = dict(metrics.read_sql("SELECT Food_ID, Quantity FROM food_listings", engine).values.tolist())
+    taken = collections.Counter()
+    for allocation in allocated:
+        taken[allocation.food_id] += allocation.quantity
+    consistent = all(
+        after[food_id] >= 0 and before[food_id] - after[food_id] == taken[food_id] for food_id in before
+    )
+
+    # Deleting the claims puts the quantities back.
+    crud.delete_many(engine, "claims", [a.claim_id for a in allocated])
+    restored = dict(metrics.read_sql("SELECT Food_ID, Quantity FROM food_listings", engine).values.tolist())
+    consistent = consistent and all(restored[food_id] == before[food_id] for food_id in taken)
+
+    timings = sorted(ms for _, ms in results)
+    return {
+        "city": city,
+        "workers": workers,
+        "claims": claims,
+        "allocated": len(allocated),
+        "in_city": sum(a.location == city for a in allocated),
+        "seconds": round(elapsed, 3),
+        "claims_per_minute": round(claims / elapsed * 60),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "lost_races": sum(a.attempts - 1 for a, _ in results if a.claim_id is not None),
+        "consistent": consistent,
+    }
+
+
+def api_benchmark(base_url, workers, seconds, revalidate=True):
+    """Poll a running api.py from ``workers`` threads for ``seconds``; returns throughput stats.
+
+    Each thread keeps one HTTP connection and cycles through the catalog
+    queries and listing endpoints. With ``revalidate`` it sends back the
+    ETag it last saw, as a polling partner app would.
+    """
+    url = urllib.parse.urlsplit(base_url)
+    with urllib.request.urlopen(base_url.rstrip("/") + "/queries") as response:
+        paths = [q["path"] for q in json.load(response) if not q["params"]]
+    paths += ["/listings", "/listings?limit=200", "/listings/open"]
+    deadline = time.perf_counter() + seconds
+
+    def poll(worker):
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        etags, timings, statuses = {}, [], collections.Counter()
+        i = worker
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            headers = {"If-None-Match": etags[path]} if revalidate and path in etags else {}
+            start = time.perf_counter()
+            conn.request("GET", url.path.rstrip("/") + path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            timings.append((time.perf_counter() - start) * 1000)
+            statuses[response.status] += 1
+            if response.getheader("ETag"):
+                etags[path] = response.getheader("ETag")
+        conn.close()
+        return timings, statuses
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(poll, range(workers)))
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(ms for t, _ in results for ms in t)
+    statuses = sum((s for _, s in results), collections.Counter())
+    return {
+        "base_url": base_url,
+        "workers": workers,
+        "revalidate": revalidate,
+        "paths": len(paths),
+        "requests": len(timings),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(timings) / elapsed, 1),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark queries, filters and CRUD actions.")
+    parser.add_argument("command", nargs="?", default="cases", choices=("cases", "matching", "api"),
+                        help="timed cases (default), the concurrent matching benchmark or an api.py load test")
+    parser.add_argument("--url", help="SQLAlchemy database URL (default: the backend configured in db.py)")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per case")
+    parser.add_argument("--only", default="", help="run only cases whose name contains this text")
+    parser.add_argument("--out", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="p50 ratio above which a case counts as a regression")
+    parser.add_argument("--workers", type=int, default=8, help="matching: concurrent claimers")
+    parser.add_argument("--claims", type=int, default=2000, help="matching: claims to make")
+    parser.add_argument("--quantity", type=int, default=1, help="matching: quantity per claim")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="api: server to load-test")
+    parser.add_argument("--seconds", type=float, default=10, help="api: how long to poll")
+    parser.add_argument("--no-revalidate", action="store_true",
+                        help="api: never send If-None-Match, so every poll gets a full response")
+    args = parser.parse_args(argv)
+
+    if args.command == "api":
+        stats = api_benchmark(args.base_url, args.workers, args.seconds, not args.no_revalidate)
+        print(json.dumps(stats, indent=2))
+        with open(args.out, "w") as f:
+            json.dump({"api": stats}, f, indent=2)
+        return
+
+    if args.url:
+        engine = analytics_engine = db.create_db_engine(args.url)
+    else:
+        engine, analytics_engine = db.get_engine(), db.get_analytics_engine()
+
+    if args.command == "matching":
+        stats = matching_benchmark(engine, args.workers, args.claims, args.quantity)
+        print(json.dumps(stats, indent=2))
+        with open(args.out, "w") as f:
+            json.dump({"meta": {"dialect": engine.dialect.name, "table_sizes": table_sizes(engine)},
+                       "matching": stats}, f, indent=2)
+        if not stats["consistent"]:
+            print("OVER-ALLOCATION: listing quantities do not match the claims made")
+            sys.exit(1)
+        return
+
+    cases = {**query_cases(engine, analytics_engine), **filter_cases(engine), **crud_cases(engine)}
+    results = {
+        "meta": {
+            "dialect": engine.dialect.name,
+            "table_sizes": table_sizes(engine),
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "cases": {},
+    }
+    for name, fn in cases.items():
+        if args.only not in name:
+            continue
+        results["cases"][name] = stats = run_case(fn, args.repeat)
+        print(f"{name:<60} p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f} ms  "
+              f"peak {stats['peak_mem_kib']:>9.1f} KiB")
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for case, before, after in regressions:
+            print(f"REGRESSION {case}: p50 {before:.2f} ms -> {after:.2f} ms")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
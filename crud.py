@@ -0,0 +1,428 @@
+"""Writes used by the CRUD tab (and the benchmark runner).
+
+Every write runs in its own transaction together with the matching update
+of the summary tables (see summaries.py) and, once committed, evicts the
+affected table from the shared table cache, bumps the table's change
+version (see versions.py) and updates its search index.
+
+:func:`import_rows` and :func:`delete_many` write a whole batch of rows with
+one executemany or ``IN`` statement. Rows are validated against the schema
+first and problems are reported per row, so a batch either goes in as a
+whole or (with ``skip_invalid``) without the rows that failed.
+
+Claim writes also take the claimed Quantity off the listing, or give it back
+when a claim is cancelled, moved or deleted, with matching.py's conditional
+update; a claim the listing cannot cover is rejected.
+"""
+import collections
+
+import pandas as pd
+from sqlalchemy import Date, DateTime, Integer, String, bindparam, text
+
+import archive
+import matching
+import metrics
+import schema
+import search
+import summaries
+import table_cache
+import versions
+
+# table -> (primary key, editable columns)
+TABLES = {
+    "providers": ("Provider_ID", ["Name", "Type", "Address", "City", "Contact"]),
+    "receivers": ("Receiver_ID", ["Name", "Type", "City", "Contact"]),
+    "food_listings": ("Food_ID", ["Food_Name", "Quantity", "Expiry_Date", "Provider_ID",
+                                  "Provider_Type", "Location", "Food_Type", "Meal_Type"]),
+    "claims": ("Claim_ID", ["Food_ID", "Receiver_ID", "Quantity", "Status", "Timestamp"]),
+}
+
+CLAIM_STATUSES = ("Pending", "Completed", "Cancelled")
+
+# ``errors`` is a list of (row number, message), rows numbered from 1.
+BatchResult = collections.namedtuple("BatchResult", "affected errors")
+
+# Keys per ``IN (...)`` list, well below every backend's bind parameter limit.
+IN_CHUNK = 500
+
+
+def _written(engine, table, keys):
+    """After a commit: evict ``table`` from the cache, bump its version and update its search index."""
+    table_cache.invalidate(table)
+    versions.bump(engine, table)
+    search.refresh(engine, table, keys)
+
+
+class _Rejected(Exception):
+    """Raised inside a batch's transaction to roll it back once rows failed."""
+
+
+def _move_stock(conn, table, old, new, as_of=None):
+    """Take or give back the listing stock a claim row holds; raises ValueError if it is short.
+
+    With ``as_of``, stock is only taken from listings that have not expired by
+    then (see matching.adjust_stock). Returns the Food_IDs of the listings that changed.
+    """
+    if table != "claims":
+        return []
+    changes = matching.stock_changes(old, new)
+    short = matching.adjust_stock(conn, changes, as_of)
+    if short is not None:
+        expired = "has expired or " if as_of is not None else ""
+        raise ValueError(f"listing {short} {expired}has less than {changes[short]} left")
+    return list(changes)
+
+
+def _stock_written(engine, food_ids):
+    # Quantity is not indexed, so the listings' search index is left alone.
+    if food_ids:
+        table_cache.invalidate("food_listings")
+        versions.bump(engine, "food_listings")
+
+
+def _lock(conn, table):
+    """``FOR UPDATE`` for reads of rows about to change; on SQLite, take the write lock instead.
+
+    SQLite has no row locks, and its driver only opens the transaction at the
+    first write, so a no-op write comes first: no other writer can change the
+    rows between this transaction's read and its write.
+    """
+    if conn.dialect.name == "sqlite":
+        pk, _ = TABLES[table]
+        metrics.execute(conn, f"UPDATE {table} SET {pk} = {pk} WHERE 0")
+        return ""
+    return " FOR UPDATE" if conn.dialect.name in ("mysql", "postgresql") else ""
+
+
+def _fetch(conn, table, key, lock=False):
+    pk, _ = TABLES[table]
+    # Lock the row we are about to change so concurrent writers see consistent old values.
+    suffix = _lock(conn, table) if lock else ""
+    sql = text(f"SELECT * FROM {table} WHERE {pk}=:pk{suffix}")
+    row = metrics.execute(conn, sql, {"pk": key}).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def fetch(engine, table, key):
+    """The current row of ``table`` with primary key ``key`` as a dict, or None."""
+    with engine.connect() as conn:
+        return _fetch(conn, table, key)
+
+
+def insert(engine, table, values, as_of=None):
+    """Insert one row and return its new primary key.
+
+    ``as_of`` is the date a claimed listing must not have expired by (default: not checked).
+    """
+    _, columns = TABLES[table]
+    sql = archive.insert_sql(engine, table, columns)
+    with metrics.view(f"{table} insert"), engine.begin() as conn:
+        moved = _move_stock(conn, table, None, values, as_of)
+        result = metrics.execute(conn, sql, {c: values[c] for c in columns})
+        if summaries.enabled(engine):
+            summaries.apply(conn, table, None, _fetch(conn, table, result.lastrowid))
+    _written(engine, table, [result.lastrowid])
+    _stock_written(engine, moved)
+    return result.lastrowid
+
+
+def update(engine, table, key, values, as_of=None):
+    """Update the row with primary key ``key``; returns the number of rows changed.
+
+    ``as_of`` is as for :func:`insert`.
+    """
+    pk, columns = TABLES[table]
+    sql = text(
+        f"UPDATE {table} SET {', '.join(f'{c}=:{c}' for c in columns)} WHERE {pk}=:pk"
+    )
+    key = int(key)
+    with metrics.view(f"{table} update"), engine.begin() as conn:
+        track = summaries.enabled(engine)
+        old = _fetch(conn, table, key, lock=True) if track or table == "claims" else None
+        moved = _move_stock(conn, table, old, values, as_of) if old is not None else []
+        result = metrics.execute(conn, sql, {"pk": key, **{c: values[c] for c in columns}})
+        if track and old is not None:
+            summaries.apply(conn, table, old, _fetch(conn, table, key))
+    _written(engine, table, [key])
+    _stock_written(engine, moved)
+    return result.rowcount
+
+
+def delete(engine, table, key):
+    """Delete the row with primary key ``key``; returns the number of rows removed."""
+    pk, _ = TABLES[table]
+    key = int(key)
+    with metrics.view(f"{table} delete"), engine.begin() as conn:
+        track = summaries.enabled(engine)
+        old = _fetch(conn, table, key, lock=True) if track or table == "claims" else None
+        moved = _move_stock(conn, table, old, None) if old is not None else []
+        result = metrics.execute(conn, f"DELETE FROM {table} WHERE {pk}=:pk", {"pk": key})
+        if track and old is not None:
+            summaries.apply(conn, table, old, None)
+    _written(engine, table, [key])
+    _stock_written(engine, moved)
+    return result.rowcount
+
+
+def _chunks(items, size=IN_CHUNK):
+    items = sorted(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _fetch_many(conn, table, keys, lock=False):
+    """Rows of ``table`` with the given primary keys, as ``{key: row}``."""
+    pk, _ = TABLES[table]
+    suffix = _lock(conn, table) if lock else ""
+    sql = text(f"SELECT * FROM {table} WHERE {pk} IN :keys{suffix}").bindparams(
+        bindparam("keys", expanding=True)
+    )
+    rows = {}
+    for chunk in _chunks(keys):
+        for row in metrics.execute(conn, sql, {"keys": chunk}).mappings():
+            rows[row[pk]] = dict(row)
+    return rows
+
+
+def _existing(conn, table, column, values):
+    """The subset of ``values`` that occur in ``table.column``."""
+    sql = text(f"SELECT DISTINCT {column} FROM {table} WHERE {column} IN :values").bindparams(
+        bindparam("values", expanding=True)
+    )
+    found = set()
+    for chunk in _chunks(values):
+        found.update(metrics.execute(conn, sql, {"values": chunk}).scalars())
+    return found
+
+
+def _parents(table):
+    """``{column: (parent table, parent column)}`` for the foreign keys of ``table``."""
+    return {
+        fk.parent.name: (fk.column.table.name, fk.column.name)
+        for fk in schema.metadata.tables[table].foreign_keys
+    }
+
+
+def _children(table):
+    """``(child table, column)`` pairs whose foreign keys point at ``table``."""
+    return [
+        (child.name, fk.parent.name)
+        for child in schema.TABLES
+        for fk in child.foreign_keys
+        if fk.column.table.name == table
+    ]
+
+
+def _coerce(table, column, value):
+    """Convert an uploaded value to the column's type; raises ValueError."""
+    column_type = schema.metadata.tables[table].c[column].type
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(column_type, String):
+        value = str(value)
+        if column_type.length and len(value) > column_type.length:
+            raise ValueError(f"{column} is longer than {column_type.length} characters")
+        return value
+    if isinstance(value, str) and not value.strip():
+        return None
+    try:
+        if isinstance(column_type, Integer):
+            if isinstance(value, float) and not value.is_integer():
+                raise ValueError
+            return int(value)
+        if isinstance(column_type, DateTime):
+            return pd.Timestamp(value).to_pydatetime()
+        if isinstance(column_type, Date):
+            return pd.Timestamp(value).date()
+    except (TypeError, ValueError):
+        kind = "a whole number" if isinstance(column_type, Integer) else "a date"
+        raise ValueError(f"{column} must be {kind}, got {value!r}") from None
+    return value
+
+
+def _validate(table, raw):
+    """Return ``(key, values)`` for one uploaded row; raises ValueError."""
+    pk, columns = TABLES[table]
+    unknown = sorted(set(raw) - {pk, *columns})
+    if unknown:
+        raise ValueError(f"unknown column(s): {', '.join(map(str, unknown))}")
+    key = _coerce(table, pk, raw.get(pk))
+    if key is None:
+        missing = [c for c in columns if c not in raw]
+        if missing:
+            raise ValueError(f"new rows need {', '.join(missing)}")
+    # An empty CSV cell in an update keeps the current value.
+    given = [c for c in columns if c in raw and (key is None or raw[c] != "")]
+    values = {c: _coerce(table, c, raw[c]) for c in given}
+    # The same limits as the single-row forms (Quantity has min_value=1 there).
+    if table == "food_listings" and "Quantity" in values and (values["Quantity"] is None or values["Quantity"] < 1):
+        raise ValueError("Quantity must be at least 1")
+    # An empty claim Quantity is allowed: such claims hold no stock, like the loaded ones.
+    if table == "claims" and values.get("Quantity") is not None and values["Quantity"] < 1:
+        raise ValueError("Quantity must be at least 1")
+    if table == "claims" and "Status" in values and values["Status"] not in CLAIM_STATUSES:
+        raise ValueError(f"Status must be one of {', '.join(CLAIM_STATUSES)}")
+    return key, values
+
+
+def _check_parents(conn, table, numbered_rows):
+    """Errors for rows whose foreign keys point at rows that do not exist."""
+    errors = []
+    for column, (parent, parent_column) in _parents(table).items():
+        wanted = {row[column] for _, row in numbered_rows if row.get(column) is not None}
+        found = _existing(conn, parent, parent_column, wanted) if wanted else set()
+        for number, row in numbered_rows:
+            if row.get(column) is not None and row[column] not in found:
+                errors.append((number, f"no {parent} row with {parent_column}={row[column]}"))
+    return errors
+
+
+def _rowcount(result, params):
+    return result.rowcount if result.rowcount >= 0 else len(params)
+
+
+def import_rows(engine, table, rows, skip_invalid=False, as_of=None):
+    """Insert or update many rows of ``table`` in one transaction.
+
+    ``rows`` are dicts keyed by column name, e.g. the records of an uploaded
+    CSV. A row with a primary key updates that row, keeping its current value
+    for any column left out or empty; a row without one is inserted and must
+    give every editable column. Returns a BatchResult. Unless ``skip_invalid`` is
+    set, nothing is written when any row fails validation. ``as_of`` is as
+    for :func:`insert`.
+    """
+    pk, columns = TABLES[table]
+    errors, inserts, updates = [], [], {}
+    for number, raw in enumerate(rows, start=1):
+        try:
+            key, values = _validate(table, raw)
+        except ValueError as exc:
+            errors.append((number, str(exc)))
+            continue
+        if key is None:
+            inserts.append((number, values))
+        elif key in updates:
+            errors.append((number, f"{pk}={key} appears more than once"))
+        else:
+            updates[key] = (number, values)
+
+    try:
+        return _import(engine, table, inserts, updates, errors, skip_invalid, as_of)
+    except _Rejected:
+        return BatchResult(0, sorted(errors))
+
+
+def _import(engine, table, inserts, updates, errors, skip_invalid, as_of):
+    pk, columns = TABLES[table]
+    insert_sql = archive.insert_sql(engine, table, columns)
+    with metrics.view(f"{table} import"), engine.begin() as conn:
+        old = _fetch_many(conn, table, updates, lock=True) if updates else {}
+        changed = []
+        for key, (number, values) in updates.items():
+            if key not in old:
+                errors.append((number, f"no {table} row with {pk}={key}"))
+            else:
+                changed.append((number, {**{c: old[key][c] for c in columns}, **values, pk: key}))
+        bad = _check_parents(conn, table, inserts + changed)
+        errors += bad
+        if errors and not skip_invalid:
+            return BatchResult(0, sorted(errors))
+        rejected = {number for number, _ in bad}
+        moved = []
+        # Row by row, so a claim its listing cannot cover is reported against that row.
+        for number, values in sorted(inserts + changed, key=lambda r: r[0]):
+            if number in rejected or table != "claims":
+                continue
+            try:
+                moved += _move_stock(conn, table, old.get(values.get(pk)), values, as_of)
+            except ValueError as exc:
+                errors.append((number, str(exc)))
+                rejected.add(number)
+                if not skip_invalid:
+                    raise _Rejected() from None
+        inserts = [values for number, values in inserts if number not in rejected]
+        changed = [values for number, values in changed if number not in rejected]
+
+        def write():
+            affected = 0
+            if inserts:
+                affected += _rowcount(metrics.execute(conn, insert_sql, inserts), inserts)
+            if changed:
+                sql = text(
+                    f"UPDATE {table} SET {', '.join(f'{c}=:{c}' for c in columns)} WHERE {pk}=:{pk}"
+                )
+                affected += _rowcount(metrics.execute(conn, sql, changed), changed)
+            # New rows have no key yet, which the summaries do not need.
+            new_rows = [{pk: None, **values} for values in inserts]
+            return affected, new_rows + list(_fetch_many(conn, table, [v[pk] for v in changed]).values())
+
+        if summaries.enabled(engine):
+            old_rows = [old[values[pk]] for values in changed]
+            affected = summaries.apply_batch(conn, table, old_rows, inserts + changed, write)
+        else:
+            affected, _ = write()
+    _written(engine, table, [values[pk] for values in changed])
+    _stock_written(engine, moved)
+    return BatchResult(affected, sorted(errors))
+
+
+def set_claim_status(engine, claim_ids, status, skip_invalid=False, as_of=None):
+    """Set the Status of many claims in one transaction; returns a BatchResult."""
+    return import_rows(
+        engine, "claims", [{"Claim_ID": key, "Status": status} for key in claim_ids], skip_invalid, as_of
+    )
+
+
+def delete_many(engine, table, keys, skip_invalid=False):
+    """Delete the rows of ``table`` with the given primary keys in one transaction.
+
+    Keys that do not exist, or whose rows are still referenced by another
+    table, are reported as errors (numbered by position in ``keys``).
+    Returns a BatchResult.
+    """
+    pk, _ = TABLES[table]
+    errors, wanted = [], {}
+    for number, key in enumerate(keys, start=1):
+        try:
+            key = _coerce(table, pk, key)
+        except ValueError as exc:
+            errors.append((number, str(exc)))
+            continue
+        if key is None:
+            errors.append((number, f"{pk} is missing"))
+        else:
+            wanted.setdefault(key, number)
+
+    with metrics.view(f"{table} delete many"), engine.begin() as conn:
+        old = _fetch_many(conn, table, wanted, lock=True) if wanted else {}
+        for key, number in wanted.items():
+            if key not in old:
+                errors.append((number, f"no {table} row with {pk}={key}"))
+        for child, column in _children(table):
+            for key in _existing(conn, child, column, old) if old else ():
+                errors.append((wanted[key], f"still referenced by {child}.{column}"))
+                old.pop(key, None)
+        if errors and not skip_invalid:
+            return BatchResult(0, sorted(errors))
+        given_back = collections.Counter()
+        if table == "claims":
+            for row in old.values():
+                given_back.update(matching.stock_changes(row, None))
+            matching.adjust_stock(conn, given_back)
+        sql = text(f"DELETE FROM {table} WHERE {pk} IN :keys").bindparams(
+            bindparam("keys", expanding=True)
+        )
+
+        def write():
+            affected = 0
+            for chunk in _chunks(old):
+                affected += metrics.execute(conn, sql, {"keys": chunk}).rowcount
+            return affected, []
+
+        if summaries.enabled(engine):
+            affected = summaries.apply_batch(conn, table, list(old.values()), [], write)
+        else:
+            affected, _ = write()
+    _written(engine, table, list(old))
+    _stock_written(engine, list(given_back))
+    return BatchResult(affected, sorted(errors))
@@ -0,0 +1,119 @@
+"""Run the whole query catalog concurrently for the dashboard mode.
+
+Queries run on a bounded thread pool, each on its own pooled connection,
+and results are yielded as soon as each one finishes, so total latency is
+close to the slowest query rather than the sum. A failing query is
+reported on its own and does not hold up the others.
+
+A query that runs longer than ``timeout`` seconds is cancelled on the
+server where the driver allows it (``interrupt()`` for SQLite and DuckDB,
+``KILL QUERY`` for MySQL, ``cancel()`` for psycopg2) and reported as timed
+out. Closing the generator early cancels whatever is still running.
+"""
+import collections
+import concurrent.futures
+import contextvars
+import time
+
+import metrics
+
+QueryResult = collections.namedtuple("QueryResult", "name frame error elapsed_ms")
+
+DEFAULT_WORKERS = 4
+
+
+class _Task:
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.started = None
+        self.cancel = None
+        self.cancelled = False
+
+
+def _canceller(engine, conn):
+    raw = conn.connection.driver_connection
+    if engine.dialect.name == "mysql":
+        thread_id = int(raw.thread_id())
+
+        def kill():
+            with engine.connect() as other:
+                other.exec_driver_sql(f"KILL QUERY {thread_id}")
+
+        return kill
+    for name in ("interrupt", "cancel"):
+        if callable(getattr(raw, name, None)):
+            return getattr(raw, name)
+    return None
+
+
+def _run(engine, task):
+    with engine.connect() as conn:
+        task.cancel = _canceller(engine, conn)
+        task.started = time.monotonic()
+        if task.cancelled:
+            raise TimeoutError("cancelled before it started")
+        return metrics.read_sql(task.sql, conn, view_name=task.name)
+
+
+def _cancel(task):
+    task.cancelled = True
+    if task.cancel is not None:
+        try:
+            task.cancel()
+        except Exception:
+            pass  # the query may have finished in the meantime
+
+
+def default_workers(engine):
+    """One worker per pooled connection, and at least DEFAULT_WORKERS for small pools (overflow covers them)."""
+    size = getattr(engine.pool, "size", None)
+    return max(DEFAULT_WORKERS, size() if callable(size) else 0)
+
+
+def run_all(engine, queries, max_workers=None, timeout=None):
+    """Run ``{name: sql}`` concurrently and yield a QueryResult per query as it completes."""
+    tasks = [_Task(name, sql) for name, sql in queries.items()]
+    workers = max(1, min(len(tasks), max_workers or default_workers(engine)))
+    executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="dashboard")
+    futures = {
+        # copy_context so the worker's statements are attributed to the calling view.
+        executor.submit(contextvars.copy_context().run, _run, engine, task): task
+        for task in tasks
+    }
+    pending = set(futures)
+    try:
+        while pending:
+            wait_for = None
+            if timeout is not None:
+                started = [futures[f].started for f in pending if futures[f].started is not None]
+                wait_for = max(0.0, min(started) + timeout - time.monotonic()) if started else timeout
+            done, pending = concurrent.futures.wait(
+                pending, timeout=wait_for, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                task = futures[future]
+                elapsed_ms = (time.monotonic() - task.started) * 1000 if task.started else 0.0
+                error = future.exception()
+                if task.cancelled:
+                    continue  # already reported as timed out
+                if error is not None:
+                    yield QueryResult(task.name, None, error, elapsed_ms)
+                else:
+                    yield QueryResult(task.name, future.result(), None, elapsed_ms)
+            if timeout is None:
+                continue
+            now = time.monotonic()
+            for future in list(pending):
+                task = futures[future]
+                if task.started is not None and now - task.started >= timeout:
+                    _cancel(task)
+                    pending.discard(future)
+                    yield QueryResult(
+                        task.name, None, TimeoutError(f"timed out after {timeout:g}s"), timeout * 1000
+                    )
+    finally:
+        for future in pending:
+            future.cancel()
+            _cancel(futures[future])
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,172 @@
+"""Generate synthetic datasets at scale for benchmarking.
+
+Usage:
+    python datagen.py --claims 1000000 --out data/1m [--seed 42]
+
+Writes providers_data.csv, receivers_data.csv, food_listings_data.csv and
+claims_data.csv in the same format as the shipped samples, so the output
+directory can be loaded with ``python loader.py --data-dir data/1m``.
+
+Categorical columns (provider/receiver types, cities, food names, food and
+meal types, claim statuses), quantities, expiry offsets and claim times are
+sampled from the distributions in the shipped CSVs. As in the samples, a
+listing's Provider_Type and Location are those of its provider. Rows are
+generated and written in chunks, so memory does not grow with the output.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from loader import CSV_FILES
+
+CHUNK_ROWS = 250_000
+
+
+class Distributions:
+    """Value frequencies observed in the shipped CSVs."""
+
+    def __init__(self, data_dir="."):
+        read = lambda table: pd.read_csv(os.path.join(data_dir, CSV_FILES[table]))
+        providers, receivers = read("providers"), read("receivers")
+        food, claims = read("food_listings"), read("claims")
+
+        self.cities = pd.concat([providers["City"], receivers["City"], food["Location"]]).dropna().unique()
+        self.provider_types = providers["Type"].value_counts(normalize=True)
+        self.receiver_types = receivers["Type"].value_counts(normalize=True)
+        self.provider_names = providers["Name"].dropna().unique()
+        self.receiver_names = receivers["Name"].dropna().unique()
+        self.food_names = food["Food_Name"].value_counts(normalize=True)
+        self.food_types = food["Food_Type"].value_counts(normalize=True)
+        self.meal_types = food["Meal_Type"].value_counts(normalize=True)
+        self.quantities = food["Quantity"].value_counts(normalize=True)
+        self.statuses = claims["Status"].value_counts(normalize=True)
+
+        timestamps = pd.to_datetime(claims["Timestamp"], format="%m/%d/%Y %H:%M")
+        expiry = pd.to_datetime(food["Expiry_Date"], format="%m/%d/%Y")
+        self.start = timestamps.min().floor("D")
+        self.claim_span = (timestamps.max() - self.start).total_seconds()
+        self.expiry_offsets = (expiry - self.start).dt.days.value_counts(normalize=True)
+
+
+def _choice(rng, dist, n):
+    return rng.choice(dist.index.to_numpy(), size=n, p=dist.to_numpy())
+
+
+def _phones(rng, n):
+    digits = rng.integers(0, 10**10, size=n)
+    return pd.Series(digits).map(lambda d: f"+1-{d // 10**7:03d}-{d // 10**4 % 1000:03d}-{d % 10**4:04d}")
+
+
+def _us_date(values, with_time=False):
+    s = values.dt.month.astype(str) + "/" + values.dt.day.astype(str) + "/" + values.dt.year.astype(str)
+    if with_time:
+        s = s + " " + values.dt.hour.astype(str) + ":" + values.dt.minute.map("{:02d}".format)
+    return s
+
+
+def _chunks(total):
+    for start in range(0, total, CHUNK_ROWS):
+        yield start, min(CHUNK_ROWS, total - start)
+
+
+def _write(path, frames):
+    for i, frame in enumerate(frames):
+        frame.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+
+
+def generate(out_dir, claims, providers=None, receivers=None, listings=None, seed=42, data_dir="."):
+    """Write a synthetic dataset to ``out_dir`` and return the row counts.
+
+    Provider and receiver counts default to a tenth of ``claims`` (at least
+    1,000) and listings default to the same count as claims, matching the
+    1:1 listing-to-claim ratio of the samples.
+    """
+    dist = Distributions(data_dir)
+    rng = np.random.default_rng(seed)
+    providers = providers or max(1000, claims // 10)
+    receivers = receivers or max(1000, claims // 10)
+    listings = listings or claims
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Provider city and type are needed again for their listings.
+    provider_city = rng.choice(dist.cities, size=providers)
+    provider_type = _choice(rng, dist.provider_types, providers)
+
+    def provider_frames():
+        for start, n in _chunks(providers):
+            ids = np.arange(start + 1, start + n + 1)
+            yield pd.DataFrame({
+                "Provider_ID": ids,
+                "Name": rng.choice(dist.provider_names, size=n),
+                "Type": provider_type[start:start + n],
+                "Address": [f"{i} Market Street" for i in ids],
+                "City": provider_city[start:start + n],
+                "Contact": _phones(rng, n),
+            })
+
+    def receiver_frames():
+        for start, n in _chunks(receivers):
+            yield pd.DataFrame({
+                "Receiver_ID": np.arange(start + 1, start + n + 1),
+                "Name": rng.choice(dist.receiver_names, size=n),
+                "Type": _choice(rng, dist.receiver_types, n),
+                "City": rng.choice(dist.cities, size=n),
+                "Contact": _phones(rng, n),
+            })
+
+    def listing_frames():
+        for start, n in _chunks(listings):
+            owner = rng.integers(0, providers, size=n)
+            expiry = dist.start + pd.to_timedelta(_choice(rng, dist.expiry_offsets, n), unit="D")
+            yield pd.DataFrame({
+                "Food_ID": np.arange(start + 1, start + n + 1),
+                "Food_Name": _choice(rng, dist.food_names, n),
+                "Quantity": _choice(rng, dist.quantities, n),
+                "Expiry_Date": _us_date(pd.Series(expiry)),
+                "Provider_ID": owner + 1,
+                "Provider_Type": provider_type[owner],
+                "Location": provider_city[owner],
+                "Food_Type": _choice(rng, dist.food_types, n),
+                "Meal_Type": _choice(rng, dist.meal_types, n),
+            })
+
+    def claim_frames():
+        for start, n in _chunks(claims):
+            seconds = rng.uniform(0, dist.claim_span, size=n)
+            timestamps = dist.start + pd.to_timedelta(seconds, unit="s")
+            yield pd.DataFrame({
+                "Claim_ID": np.arange(start + 1, start + n + 1),
+                "Food_ID": rng.integers(1, listings + 1, size=n),
+                "Receiver_ID": rng.integers(1, receivers + 1, size=n),
+                "Status": _choice(rng, dist.statuses, n),
+                "Timestamp": _us_date(pd.Series(timestamps), with_time=True),
+            })
+
+    _write(os.path.join(out_dir, CSV_FILES["providers"]), provider_frames())
+    _write(os.path.join(out_dir, CSV_FILES["receivers"]), receiver_frames())
+    _write(os.path.join(out_dir, CSV_FILES["food_listings"]), listing_frames())
+    _write(os.path.join(out_dir, CSV_FILES["claims"]), claim_frames())
+    return {"providers": providers, "receivers": receivers, "food_listings": listings, "claims": claims}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic food wastage dataset.")
+    parser.add_argument("--claims", type=int, required=True, help="number of claims, e.g. 10000, 1000000")
+    parser.add_argument("--listings", type=int, help="number of food listings (default: same as claims)")
+    parser.add_argument("--providers", type=int, help="number of providers (default: claims / 10)")
+    parser.add_argument("--receivers", type=int, help="number of receivers (default: claims / 10)")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=".", help="directory with the sample CSVs")
+    args = parser.parse_args(argv)
+
+    counts = generate(args.out, args.claims, args.providers, args.receivers, args.listings,
+                      args.seed, args.data_dir)
+    for table, rows in counts.items():
+        print(f"{table}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
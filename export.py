@@ -0,0 +1,273 @@
+"""Stream catalog query results and whole tables to CSV, gzip CSV or Parquet.
+
+Rows are read through :func:`metrics.stream`, which uses a server-side
+cursor (``stream_results``) and hands back ``CHUNK_ROWS`` rows at a time.
+Each chunk is written out before the next one is fetched, so memory stays
+bounded by the chunk size whatever the size of the result. CSV gets its
+header with the first chunk only; Parquet writes one row group per chunk,
+every chunk cast to one fixed schema. Whole-table exports take that schema
+from the column types in schema.py; for a query it comes from the first
+chunk, with columns that are all NULL there typed as strings. :func:`stream`
+yields the encoded file piece by piece instead, for streaming HTTP
+responses (see api.py).
+
+Usage:
+    python export.py --table claims --format csv.gz --out claims.csv.gz [--url URL]
+    python export.py --query "Claims per food item" --format parquet --out claims.parquet
+    python export.py --query "Provider contact info by city" --city Chennai --out contacts.csv
+
+Parquet needs pyarrow.
+"""
+import argparse
+import re
+import sys
+import zlib
+
+from sqlalchemy import Date, DateTime, Float, Integer, Numeric
+
+import db
+import metrics
+import query_catalog
+import schema
+import summaries
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only needed for Parquet
+    pa = pq = None
+
+CHUNK_ROWS = 10_000
+
+# format -> (file suffix, MIME type)
+FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "csv.gz": (".csv.gz", "application/gzip"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+CONTACTS_QUERY = "Provider contact info by city"
+
+
+def catalog(engine):
+    """``{name: sql}`` for the catalog queries, from the summary tables where they exist.
+
+    The parameterized contact query maps to PROVIDER_CONTACTS_BY_CITY (needs ``city``).
+    """
+    queries = dict(query_catalog.QUERIES)
+    if summaries.enabled(engine):
+        queries.update(query_catalog.SUMMARY_QUERIES)
+    queries[CONTACTS_QUERY] = query_catalog.PROVIDER_CONTACTS_BY_CITY
+    return queries
+
+
+def _table(table):
+    tables = {t.name: t for t in schema.TABLES}
+    if table not in tables:
+        raise ValueError(f"unknown table {table!r}")
+    return tables[table]
+
+
+def table_sql(table):
+    """``SELECT *`` for one of the four tables, in primary key order."""
+    key = list(_table(table).primary_key)[0].name
+    return f"SELECT * FROM {table} ORDER BY {key}"
+
+
+def table_columns(table):
+    """The columns of one of the four tables, to type a Parquet export of :func:`table_sql`."""
+    return list(_table(table).columns)
+
+
+def slug(name):
+    """``name`` as a file or URL name: "Claims per food item" -> claims_per_food_item."""
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def file_name(name, fmt):
+    """A download file name for ``name`` ("Claims per food item" -> claims_per_food_item.csv)."""
+    return slug(name) + FORMATS[fmt][0]
+
+
+class _Pieces:
+    """Write-only file object that collects what is written until it is taken."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def _csv(chunks):
+    for i, chunk in enumerate(chunks):
+        yield chunk.to_csv(header=i == 0, index=False).encode("utf-8")
+
+
+def _gzip(pieces):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _arrow_type(sql_type):
+    for types, arrow_type in (
+        (Integer, pa.int64()),
+        ((Float, Numeric), pa.float64()),
+        (DateTime, pa.timestamp("us")),
+        (Date, pa.date32()),
+    ):
+        if isinstance(sql_type, types):
+            return arrow_type
+    return pa.string()
+
+
+def _parquet_schema(chunk, columns=None):
+    """The file's schema: ``columns``' types where given, otherwise the first chunk's."""
+    known = {c.name: _arrow_type(c.type) for c in columns or ()}
+    fields = []
+    for field in pa.Schema.from_pandas(chunk, preserve_index=False):
+        arrow_type = known.get(field.name, field.type)
+        # A column that is all NULL in the first chunk says nothing about its type.
+        fields.append(pa.field(field.name, pa.string() if pa.types.is_null(arrow_type) else arrow_type))
+    return pa.schema(fields)
+
+
+def _arrow_table(chunk, arrow_schema):
+    # Cast column by column: a later chunk may hold NULLs (floats) in an integer
+    # column, or dates as text (SQLite), where the schema expects something else.
+    return pa.Table.from_arrays(
+        [pa.array(chunk[f.name], from_pandas=True).cast(f.type) for f in arrow_schema], schema=arrow_schema
+    )
+
+
+def _parquet(chunks, columns=None):
+    if pq is None:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+    sink = _Pieces()
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                arrow_schema = _parquet_schema(chunk, columns)
+                writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), arrow_schema)
+            writer.write_table(_arrow_table(chunk, arrow_schema))
+            yield sink.take()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.take()
+
+
+def encode(chunks, fmt, columns=None):
+    """Yield DataFrame ``chunks`` encoded as ``fmt``, one piece of bytes per chunk.
+
+    The pieces concatenated are the complete file, so they can be written out
+    or sent as a streaming HTTP response as they come. ``columns`` (see
+    :func:`table_columns`) types the Parquet schema.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}")
+    if fmt == "parquet":
+        return _parquet(chunks, columns)
+    if fmt == "csv.gz":
+        return _gzip(_csv(chunks))
+    return _csv(chunks)
+
+
+def write(chunks, out, fmt, columns=None):
+    """Write DataFrame ``chunks`` to the binary file object ``out``; returns the row count."""
+    rows = 0
+
+    def counted():
+        nonlocal rows
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+
+    for piece in encode(counted(), fmt, columns):
+        out.write(piece)
+    return rows
+
+
+def export(engine, sql, out, fmt="csv", params=None, chunk_rows=CHUNK_ROWS, view_name="export",
+           columns=None):
+    """Stream the result of ``sql`` into ``out`` (a path or binary file object).
+
+    Returns the number of rows written.
+    """
+    if isinstance(out, str):
+        with open(out, "wb") as f:
+            return export(engine, sql, f, fmt, params, chunk_rows, view_name, columns)
+    with engine.connect() as conn:
+        return write(metrics.stream(conn, sql, params, chunk_rows, view_name), out, fmt, columns)
+
+
+def stream(engine, sql, fmt="csv", params=None, chunk_rows=CHUNK_ROWS, view_name="export",
+           columns=None):
+    """Yield the result of ``sql`` encoded as ``fmt``, piece by piece (see :func:`encode`).
+
+    The connection is held until the generator is exhausted or closed.
+    """
+    with engine.connect() as conn:
+        yield from encode(metrics.stream(conn, sql, params, chunk_rows, view_name), fmt, columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a catalog query or a table in chunks.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--query", help="catalog query name (see query_catalog.py)")
+    source.add_argument("--table", choices=[t.name for t in schema.TABLES])
+    parser.add_argument("--city", help=f"city for {CONTACTS_QUERY!r}")
+    parser.add_argument("--format", default="csv", choices=FORMATS)
+    parser.add_argument("--out", help="output file (default: derived from the query or table name)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--url", help="SQLAlchemy database URL (default: the backend configured in db.py)")
+    args = parser.parse_args(argv)
+
+    engine = db.create_db_engine(args.url) if args.url else db.get_engine()
+    params = columns = None
+    if args.table:
+        name, sql, columns = args.table, table_sql(args.table), table_columns(args.table)
+    else:
+        queries = catalog(engine)
+        if args.query not in queries:
+            parser.error(f"unknown query {args.query!r}; choose from: " + ", ".join(queries))
+        name, sql = args.query, queries[args.query]
+        if args.query == CONTACTS_QUERY:
+            if not args.city:
+                parser.error("--city is required for this query")
+            params = {"city": args.city}
+        elif not args.url:
+            engine = db.get_analytics_engine()
+    out = args.out or file_name(name, args.format)
+    try:
+        rows = export(engine, sql, out, args.format, params, args.chunk_rows, columns=columns)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print(f"{rows} rows written to {out}")
+
+
+if __name__ == "__main__":
+    main()
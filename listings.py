@@ -0,0 +1,95 @@
+"""Server-side queries behind the Filter & Contact view.
+
+Filtering happens in SQL and results are paged by Food_ID (keyset
+pagination), so the cost of a page does not depend on how many listings
+exist. Run ``python migrate.py`` once so these predicates are indexed.
+"""
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+import metrics
+import table_cache
+
+PAGE_SIZE = 50
+
+
+def filter_options(engine):
+    """Distinct values for the location, provider and food type selectboxes."""
+    locations = table_cache.read_sql(
+        engine,
+        "SELECT DISTINCT Location FROM food_listings WHERE Location IS NOT NULL ORDER BY Location",
+        ("food_listings",),
+    )["Location"].tolist()
+    provider_names = table_cache.read_sql(
+        engine,
+        "SELECT DISTINCT Name FROM providers WHERE Name IS NOT NULL ORDER BY Name",
+        ("providers",),
+    )["Name"].tolist()
+    return locations, provider_names, food_types(engine)
+
+
+def food_types(engine):
+    """Distinct food types; there are few enough to list them all."""
+    return table_cache.read_sql(
+        engine,
+        "SELECT DISTINCT Food_Type FROM food_listings WHERE Food_Type IS NOT NULL ORDER BY Food_Type",
+        ("food_listings",),
+    )["Food_Type"].tolist()
+
+
+def _filters(location=None, provider=None, food_type=None):
+    clauses, params = [], {}
+    if location is not None:
+        clauses.append("f.Location = :location")
+        params["location"] = location
+    if provider is not None:
+        clauses.append("f.Provider_ID IN (SELECT Provider_ID FROM providers WHERE Name = :provider)")
+        params["provider"] = provider
+    if food_type is not None:
+        clauses.append("f.Food_Type = :food_type")
+        params["food_type"] = food_type
+    return clauses, params
+
+
+def listings_page(engine, location=None, provider=None, food_type=None, after_id=0, limit=PAGE_SIZE):
+    """Return ``(page, has_more)`` for listings with Food_ID greater than ``after_id``.
+
+    Pass the last Food_ID of a page as ``after_id`` to fetch the next one.
+    """
+    clauses, params = _filters(location, provider, food_type)
+    clauses.append("f.Food_ID > :after_id")
+    params.update(after_id=int(after_id), limit=int(limit) + 1)
+    sql = text(
+        "SELECT f.* FROM food_listings f WHERE " + " AND ".join(clauses)
+        + " ORDER BY f.Food_ID LIMIT :limit"
+    )
+    page = metrics.read_sql(sql, engine, params=params)
+    return page.head(limit), len(page) > limit
+
+
+def provider_contacts(engine, food_ids):
+    """Providers of the given listings, ordered by Provider_ID."""
+    if not food_ids:
+        return pd.DataFrame(columns=["Provider_ID", "Name", "Contact"])
+    sql = text("""
+        SELECT p.Provider_ID, p.Name, p.Contact
+        FROM providers p
+        JOIN (SELECT DISTINCT Provider_ID FROM food_listings WHERE Food_ID IN :food_ids) f
+          ON f.Provider_ID = p.Provider_ID
+        ORDER BY p.Provider_ID
+    """).bindparams(bindparam("food_ids", expanding=True))
+    return metrics.read_sql(sql, engine, params={"food_ids": [int(i) for i in food_ids]})
+
+
+def receiver_contacts(engine, food_ids):
+    """Receivers that have claimed any of the given listings, ordered by Receiver_ID."""
+    if not food_ids:
+        return pd.DataFrame(columns=["Receiver_ID", "Name", "Contact"])
+    sql = text("""
+        SELECT r.Receiver_ID, r.Name, r.Contact
+        FROM receivers r
+        JOIN (SELECT DISTINCT Receiver_ID FROM claims WHERE Food_ID IN :food_ids) c
+          ON c.Receiver_ID = r.Receiver_ID
+        ORDER BY r.Receiver_ID
+    """).bindparams(bindparam("food_ids", expanding=True))
+    return metrics.read_sql(sql, engine, params={"food_ids": [int(i) for i in food_ids]})
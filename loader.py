@@ -0,0 +1,198 @@
+"""Stream the CSV datasets into the database.
+
+Usage:
+    python loader.py [--url URL] [--data-dir DIR] [--mode replace|upsert] [--chunksize N]
+
+For a local embedded database with no MySQL server:
+    FOODWASTE_BACKEND=embedded python loader.py --mode replace
+
+``replace`` drops and recreates the four tables from schema.py before
+loading, and empties the archive (see archive.py). ``upsert`` creates any
+missing tables and inserts or updates rows by primary key, leaving
+everything else in place, which is what a nightly feed should use.
+
+CSVs are read ``--chunksize`` rows at a time and each chunk is written as
+one batched insert in its own transaction, so memory stays flat no matter
+how large the files are.
+
+Claims with a Quantity take it off their listing in the same transaction,
+through matching.py's conditional update; rows whose listing has too little
+left are skipped and counted on stderr. In ``upsert`` mode, an existing
+listing's Quantity from the feed is reduced by what its claims already
+hold, in the same statement. Listings and claims whose key is already in
+the archive (see archive.py), and claims on an archived listing, are
+skipped, so an archived row never gets a live twin.
+"""
+import argparse
+import os
+import sys
+
+import pandas as pd
+from sqlalchemy import func, literal_column, or_, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+import archive
+import db
+import matching
+import metrics
+import schema
+import snapshot
+import summaries
+import versions
+
+CSV_FILES = {
+    "providers": "providers_data.csv",
+    "receivers": "receivers_data.csv",
+    "food_listings": "food_listings_data.csv",
+    "claims": "claims_data.csv",
+}
+
+# Formats used by the shipped CSVs, e.g. "3/17/2025" and "3/5/2025 5:26".
+DATE_COLUMNS = {
+    "food_listings": {"Expiry_Date": "%m/%d/%Y"},
+    "claims": {"Timestamp": "%m/%d/%Y %H:%M"},
+}
+
+
+def _held(engine, table):
+    """What the claims on the row being upserted hold (see matching.holds)."""
+    claims = schema.claims.c
+    # The upsert's target row is not a FROM that SQLAlchemy can correlate to, so it is named outright.
+    quote = engine.dialect.identifier_preparer.quote
+    food_id = literal_column(f"{quote(table.name)}.{quote('Food_ID')}")
+    return select(func.coalesce(func.sum(claims.Quantity), 0)).where(
+        claims.Food_ID == food_id, claims.Quantity.is_not(None),
+        or_(claims.Status.is_(None), claims.Status != "Cancelled"),
+    ).scalar_subquery()
+
+
+def insert_statement(engine, table, mode):
+    if mode != "upsert":
+        return table.insert()
+    updates = [c.name for c in table.columns if not c.primary_key]
+    dialect = engine.dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        new = stmt.inserted
+    elif dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        new = stmt.excluded
+    else:
+        raise ValueError(f"upsert is not supported for the {dialect} dialect")
+    values = {c: new[c] for c in updates}
+    if table is schema.food_listings:
+        # The feed gives a listing's full Quantity; what its claims hold stays taken.
+        values["Quantity"] = new.Quantity - _held(engine, table)
+    if dialect == "mysql":
+        return stmt.on_duplicate_key_update(values)
+    return stmt.on_conflict_do_update(index_elements=[c.name for c in table.primary_key], set_=values)
+
+
+def prepare_chunk(table_name, chunk):
+    for column, fmt in DATE_COLUMNS.get(table_name, {}).items():
+        parsed = pd.to_datetime(chunk[column], format=fmt, errors="coerce")
+        bad = parsed.isna() & chunk[column].notna()
+        if bad.any():
+            print(f"  {table_name}: {int(bad.sum())} unparseable {column} values stored as NULL",
+                  file=sys.stderr)
+        chunk[column] = parsed.dt.date if column == "Expiry_Date" else parsed
+    chunk = chunk.astype(object)
+    return chunk.where(chunk.notna(), None).to_dict("records")
+
+
+def hold_stock(conn, records):
+    """Move listing stock for a chunk of claims; returns the records whose listings cover them.
+
+    A claim being replaced gives back what it held first (see matching.stock_changes).
+    """
+    ids = [r["Claim_ID"] for r in records if r.get("Claim_ID") is not None]
+    old = {}
+    for start in range(0, len(ids), 500):
+        rows = metrics.execute(
+            conn, schema.claims.select().where(schema.claims.c.Claim_ID.in_(ids[start:start + 500]))
+        ).mappings()
+        old.update((row["Claim_ID"], dict(row)) for row in rows)
+    kept = []
+    for record in records:
+        if record.get("Quantity") is not None:
+            record["Quantity"] = int(record["Quantity"])
+        changes = matching.stock_changes(old.get(record.get("Claim_ID")), record)
+        if matching.adjust_stock(conn, changes) is None:
+            kept.append(record)
+    if len(kept) < len(records):
+        print(f"  claims: {len(records) - len(kept)} rows skipped, their listings have too little left",
+              file=sys.stderr)
+    return kept
+
+
+def drop_archived(conn, table, records):
+    """The records whose key, and for claims whose listing, is not in the archive."""
+    checks = [(list(table.primary_key)[0].name, table.name)]
+    if table is schema.claims:
+        checks.append(("Food_ID", "food_listings"))
+    kept = records
+    for column, archived_table in checks:
+        archived = archive.archived_keys(
+            conn, archived_table, {r[column] for r in kept if r.get(column) is not None})
+        kept = [r for r in kept if r.get(column) not in archived]
+    if len(kept) < len(records):
+        print(f"  {table.name}: {len(records) - len(kept)} rows skipped, they are archived", file=sys.stderr)
+    return kept
+
+
+def load_table(engine, table, path, mode, chunksize):
+    stmt = insert_statement(engine, table, mode)
+    total = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        records = prepare_chunk(table.name, chunk)
+        with engine.begin() as conn:
+            if mode == "upsert":
+                records = drop_archived(conn, table, records)
+            if table is schema.claims:
+                records = hold_stock(conn, records)
+            if records:
+                metrics.execute(conn, stmt, records, view_name=f"loader {table.name}")
+        total += len(records)
+    return total
+
+
+def load(engine, data_dir=".", mode="upsert", chunksize=50_000):
+    archived = mode == "replace" and archive.enabled(engine)
+    if mode == "replace":
+        # The archived rows came from the data being replaced, and their keys
+        # would clash with the reloaded ones; the views go first (they depend
+        # on the tables).
+        archive.drop(engine)
+        schema.metadata.drop_all(engine)
+    schema.metadata.create_all(engine)
+    if archived:
+        archive.create(engine)
+    counts = {}
+    for table in schema.TABLES:
+        path = os.path.join(data_dir, CSV_FILES[table.name])
+        if not os.path.exists(path):
+            continue
+        counts[table.name] = load_table(engine, table, path, mode, chunksize)
+    # Bulk loads bypass crud.py, so recompute the analytics summaries once at the end.
+    summaries.rebuild(engine)
+    versions.bump(engine, *versions.TABLES, *versions.INDEXES.values())
+    if snapshot.snapshot_dir():
+        snapshot.build(engine, snapshot.snapshot_dir())
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the food wastage CSVs into the database.")
+    parser.add_argument("--url", help="SQLAlchemy database URL (default: the backend configured in db.py)")
+    parser.add_argument("--data-dir", default=".", help="directory containing the CSV files")
+    parser.add_argument("--mode", choices=("replace", "upsert"), default="upsert")
+    parser.add_argument("--chunksize", type=int, default=50_000, help="rows per batch")
+    args = parser.parse_args(argv)
+
+    engine = db.create_db_engine(args.url)
+    for table, rows in load(engine, args.data_dir, args.mode, args.chunksize).items():
+        print(f"{table}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
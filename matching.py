@@ -0,0 +1,178 @@
+"""Match receivers to open food listings and claim them safely.
+
+A listing is open while its Quantity is positive and its Expiry_Date has
+not passed. :func:`claim` hands a receiver the soonest-expiring open
+listing in the receiver's own city that still has enough food, falling
+back to other cities only when there is none, and takes the quantity off
+the listing.
+
+Claiming is optimistic: candidates are read without locks, then taken with
+a conditional ``UPDATE ... SET Quantity = Quantity - :q WHERE Quantity >=
+:q``. The database applies that check and the decrement atomically, so
+concurrent claimers (threads, sessions or processes) can never allocate
+more than a listing holds. A claimer that loses the race moves on to the
+next candidate. The claim row is inserted in the same transaction as the
+decrement. Run ``python migrate.py`` so the candidate lookup uses the
+``(Location, Expiry_Date)`` index and claims have their Quantity column.
+
+A claim keeps its Quantity off the listing until it is cancelled or
+deleted. Every other claim write (crud.py's single-row and batch writes,
+loader.py) moves stock with :func:`stock_changes` and :func:`adjust_stock`,
+so the same conditional update guards them all. Claims without a Quantity
+(loaded from the original CSVs) hold no stock.
+"""
+import collections
+import datetime
+
+import archive
+import metrics
+import summaries
+import table_cache
+import versions
+
+# claim_id/food_id are None when nothing could be allocated; attempts counts
+# the listings tried, so attempts > 1 means other claimers got there first.
+Allocation = collections.namedtuple("Allocation", "claim_id food_id location quantity attempts")
+
+CANDIDATES = 20
+
+_OPEN = "Quantity >= :quantity AND Expiry_Date >= :as_of"
+
+
+def receiver_city(engine, receiver_id):
+    row = metrics.read_sql(
+        "SELECT City FROM receivers WHERE Receiver_ID = :rid", engine, params={"rid": int(receiver_id)}
+    )
+    return None if row.empty else row["City"].iloc[0]
+
+
+def open_listings(engine, city=None, quantity=1, as_of=None, limit=CANDIDATES):
+    """Open listings with at least ``quantity`` left, soonest-expiring first.
+
+    With ``city`` only that city's listings are returned.
+    """
+    params = {"quantity": int(quantity), "as_of": as_of or datetime.date.today(), "limit": int(limit)}
+    where = _OPEN
+    if city is not None:
+        where = f"Location = :city AND {where}"
+        params["city"] = city
+    return metrics.read_sql(
+        f"SELECT * FROM food_listings WHERE {where} ORDER BY Expiry_Date, Food_ID LIMIT :limit",
+        engine, params=params,
+    )
+
+
+def holds(claim):
+    """``{food_id: quantity}`` the claim row keeps off its listing (nothing once cancelled)."""
+    if (claim is None or claim.get("Food_ID") is None or claim.get("Quantity") is None
+            or claim.get("Status") == "Cancelled"):
+        return {}
+    return {claim["Food_ID"]: claim["Quantity"]}
+
+
+def stock_changes(old, new):
+    """``{food_id: quantity}`` to take from (negative: give back to) listings when a claim row
+    changes from ``old`` to ``new``; either is None for an insert or a delete."""
+    changes = collections.Counter(holds(new))
+    changes.subtract(holds(old))
+    return {food_id: quantity for food_id, quantity in changes.items() if quantity}
+
+
+def adjust_stock(conn, changes, as_of=None):
+    """Apply :func:`stock_changes` inside the claim write's transaction.
+
+    Stock is taken with the conditional update (and, with ``as_of``, only from
+    listings that have not expired), before anything is given back, so nothing
+    has changed when it fails. Returns the Food_ID that had too little left,
+    or None once everything is applied.
+    """
+    take = f"Food_ID = :fid AND {_OPEN}" if as_of is not None else "Food_ID = :fid AND Quantity >= :quantity"
+    for food_id, quantity in sorted(changes.items(), key=lambda c: -c[1]):
+        if quantity > 0:
+            sql = f"UPDATE food_listings SET Quantity = Quantity - :quantity WHERE {take}"
+        else:
+            sql = "UPDATE food_listings SET Quantity = Quantity - :quantity WHERE Food_ID = :fid"
+        params = {"fid": food_id, "quantity": quantity, "as_of": as_of}
+        if not metrics.execute(conn, sql, params).rowcount:
+            if quantity > 0:
+                return food_id
+            continue  # the listing is gone; there is nothing to give back to
+        if summaries.enabled(conn.engine):
+            listing = dict(metrics.execute(
+                conn, "SELECT * FROM food_listings WHERE Food_ID = :fid", {"fid": food_id}
+            ).mappings().one())
+            if listing["Quantity"] is not None:
+                summaries.apply(conn, "food_listings",
+                                {**listing, "Quantity": listing["Quantity"] + quantity}, listing)
+    return None
+
+
+def _take(engine, food_id, receiver_id, quantity, as_of, status, timestamp):
+    """Take ``quantity`` from one listing and record the claim.
+
+    Returns ``(claim_id, location)``, or None if the listing no longer has enough.
+    """
+    claim = {"Food_ID": food_id, "Receiver_ID": receiver_id, "Quantity": quantity,
+             "Status": status, "Timestamp": timestamp}
+    insert = archive.insert_sql(engine, "claims", list(claim))
+    with engine.begin() as conn:
+        # The decrement is the first statement so the transaction starts as a
+        # writer (SQLite then waits on busy_timeout instead of failing).
+        if adjust_stock(conn, {food_id: quantity}, as_of) is not None:
+            return None
+        # A cancelled claim holds nothing, so only its row is written.
+        if status == "Cancelled":
+            adjust_stock(conn, {food_id: -quantity})
+        location = metrics.execute(
+            conn, "SELECT Location FROM food_listings WHERE Food_ID = :fid", {"fid": food_id}
+        ).scalar()
+        claim_id = metrics.execute(conn, insert, claim).lastrowid
+        if summaries.enabled(engine):
+            summaries.apply(conn, "claims", None, {**claim, "Claim_ID": claim_id})
+    return claim_id, location
+
+
+def _candidates(engine, city, quantity, as_of):
+    """Food_IDs to try: listings in ``city`` first, then anywhere."""
+    tried = set()
+    for scope in ([city] if city is not None else []) + [None]:
+        # Re-query until the search runs dry: a claimer that lost every race
+        # sees the listings that are still open.
+        while True:
+            found = open_listings(engine, scope, quantity, as_of, limit=CANDIDATES + len(tried))
+            found = [f for f in found["Food_ID"].tolist() if f not in tried]
+            if not found:
+                break
+            tried.update(found)
+            yield from found
+
+
+def claim(engine, receiver_id, quantity=1, food_id=None, city=None, as_of=None,
+          status="Pending", timestamp=None):
+    """Claim ``quantity`` of food for a receiver and return an Allocation.
+
+    With ``food_id`` only that listing is tried; otherwise ``city`` (by
+    default the receiver's) is searched first, then every city. ``as_of`` is
+    the date listings must not have expired by (default: today).
+    """
+    receiver_id, quantity = int(receiver_id), int(quantity)
+    if quantity < 1:
+        raise ValueError("quantity must be at least 1")
+    as_of = as_of or datetime.date.today()
+    timestamp = timestamp or datetime.datetime.now().replace(microsecond=0)
+    attempts = 0
+    with metrics.view("matching claim"):
+        if food_id is not None:
+            candidates = [int(food_id)]
+        else:
+            city = city if city is not None else receiver_city(engine, receiver_id)
+            candidates = _candidates(engine, city, quantity, as_of)
+        for candidate in candidates:
+            attempts += 1
+            taken = _take(engine, candidate, receiver_id, quantity, as_of, status, timestamp)
+            if taken is not None:
+                table_cache.invalidate("food_listings")
+                table_cache.invalidate("claims")
+                versions.bump(engine, "food_listings", "claims")
+                return Allocation(taken[0], candidate, taken[1], quantity, attempts)
+    return Allocation(None, None, None, quantity, attempts)
@@ -0,0 +1,276 @@
+"""Instrumented executor for every statement the app sends to the database.
+
+All reads go through :func:`read_sql` (or :func:`stream` for exports) and all
+writes through :func:`execute`.
+Each call records wall time, rows returned or affected, result bytes and the
+calling view, which is set with the :func:`view` context manager (views nest,
+e.g. ``"CRUD Operations / claims update"``).
+
+Recorded data is process-wide. It is shown in the app's Admin tab and can be
+exported as JSON or Prometheus text with :func:`export`. Setting
+``FOODWASTE_METRICS_FILE`` (``.json`` or ``.prom``) also writes it there
+periodically.
+"""
+import collections
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+
+SAMPLES_PER_STATEMENT = 1000
+RECENT_EVENTS = 5000
+EXPORT_INTERVAL = float(os.environ.get("FOODWASTE_METRICS_INTERVAL", "10"))
+
+_current_view = contextvars.ContextVar("foodwaste_view", default="")
+
+
+class _StatementStats:
+    def __init__(self, sql):
+        self.sql = sql
+        self.id = hashlib.sha1(sql.encode()).hexdigest()[:12]
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.samples = collections.deque(maxlen=SAMPLES_PER_STATEMENT)
+        self.views = collections.Counter()
+        self.last_params = None
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._recent = collections.deque(maxlen=RECENT_EVENTS)
+
+    def record(self, sql, elapsed_ms, rows, nbytes, view, params):
+        with self._lock:
+            stats = self._statements.get(sql)
+            if stats is None:
+                stats = self._statements[sql] = _StatementStats(sql)
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.rows += rows
+            stats.bytes += nbytes
+            stats.samples.append(elapsed_ms)
+            stats.views[view] += 1
+            stats.last_params = params
+            self._recent.append({
+                "statement_id": stats.id, "view": view, "ms": round(elapsed_ms, 3),
+                "rows": rows, "bytes": nbytes, "at": time.time(),
+            })
+
+    def statements(self):
+        """Per-statement summaries, slowest p95 first."""
+        with self._lock:
+            snapshot = [(s, sorted(s.samples), dict(s.views)) for s in self._statements.values()]
+        rows = []
+        for stats, samples, views in snapshot:
+            rows.append({
+                "statement_id": stats.id,
+                "sql": stats.sql,
+                "views": views,
+                "count": stats.count,
+                "mean_ms": round(stats.total_ms / stats.count, 3),
+                "p50_ms": round(_percentile(samples, 50), 3),
+                "p95_ms": round(_percentile(samples, 95), 3),
+                "p99_ms": round(_percentile(samples, 99), 3),
+                "max_ms": round(stats.max_ms, 3),
+                "rows": stats.rows,
+                "bytes": stats.bytes,
+            })
+        return sorted(rows, key=lambda r: r["p95_ms"], reverse=True)
+
+    def slowest_calls(self, n=20):
+        with self._lock:
+            recent = list(self._recent)
+        return sorted(recent, key=lambda e: e["ms"], reverse=True)[:n]
+
+    def last_params(self, statement_id):
+        with self._lock:
+            for stats in self._statements.values():
+                if stats.id == statement_id:
+                    return stats.sql, stats.last_params
+        return None, None
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._recent.clear()
+
+
+registry = Registry()
+_last_export = 0.0
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+@contextlib.contextmanager
+def view(name):
+    """Attribute statements run inside this block to ``name`` (nested under the current view)."""
+    parent = _current_view.get()
+    token = _current_view.set(f"{parent} / {name}" if parent else name)
+    try:
+        yield
+    finally:
+        _current_view.reset(token)
+
+
+def _statement_text(statement, dialect=None):
+    if isinstance(statement, TextClause):
+        sql = statement.text
+    else:
+        sql = str(statement.compile(dialect=dialect))
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";")
+
+
+def _row_bytes(rows):
+    return sum(len(str(value)) for row in rows for value in row)
+
+
+def read_sql(sql, con, params=None, view_name=None, **kwargs):
+    """``pd.read_sql`` that records timing, row count and result size."""
+    statement = text(sql) if isinstance(sql, str) else sql
+    start = time.perf_counter()
+    df = pd.read_sql(statement, con, params=params, **kwargs)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    registry.record(
+        _statement_text(statement, getattr(con, "dialect", None)), elapsed_ms, len(df),
+        int(df.memory_usage(deep=True).sum()), _view(view_name), _params(params),
+    )
+    return df
+
+
+def execute(conn, sql, params=None, view_name=None):
+    """``conn.execute`` that records timing and rows; row-returning results are buffered."""
+    statement = text(sql) if isinstance(sql, str) else sql
+    start = time.perf_counter()
+    result = conn.execute(statement, params) if params is not None else conn.execute(statement)
+    if result.returns_rows:
+        frozen = result.freeze()
+        rows = frozen.data
+        result = frozen()
+        count, nbytes = len(rows), _row_bytes(rows)
+    else:
+        count, nbytes = max(result.rowcount, 0), 0
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    registry.record(_statement_text(statement, conn.dialect), elapsed_ms, count, nbytes,
+                    _view(view_name), _params(params))
+    return result
+
+
+def stream(conn, sql, params=None, chunk_rows=10_000, view_name=None):
+    """Yield the result of ``sql`` as DataFrames of up to ``chunk_rows`` rows.
+
+    Uses a server-side cursor where the driver has one, so only one chunk is
+    in memory at a time. The statement is recorded once the result is
+    exhausted (or abandoned), with its total rows and bytes.
+    """
+    statement = text(sql) if isinstance(sql, str) else sql
+    start = time.perf_counter()
+    count = nbytes = 0
+    try:
+        result = conn.execution_options(stream_results=True).execute(statement, params or {})
+        columns = list(result.keys())
+        chunks = 0
+        for rows in result.partitions(chunk_rows):
+            chunk = pd.DataFrame(rows, columns=columns)
+            chunks += 1
+            count += len(chunk)
+            nbytes += int(chunk.memory_usage(deep=True).sum())
+            yield chunk
+        if not chunks:
+            yield pd.DataFrame(columns=columns)  # so callers still see the columns
+    finally:
+        registry.record(_statement_text(statement, conn.dialect), (time.perf_counter() - start) * 1000,
+                        count, nbytes, _view(view_name), _params(params))
+
+
+def _view(view_name):
+    current = _current_view.get()
+    if view_name:
+        return f"{current} / {view_name}" if current else view_name
+    return current or "(none)"
+
+
+def _params(params):
+    # executemany batches are recorded by size only.
+    if isinstance(params, (list, tuple)):
+        return None
+    return dict(params) if params else None
+
+
+def explain(engine, statement_id):
+    """EXPLAIN output for a recorded SELECT, using its most recent parameters."""
+    sql, params = registry.last_params(statement_id)
+    if sql is None:
+        raise KeyError(statement_id)
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        raise ValueError("only SELECT statements can be explained")
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    with engine.connect() as conn:
+        return pd.read_sql(text(prefix + sql), conn, params=params)
+
+
+def to_json():
+    return json.dumps({
+        "generated_at": time.time(),
+        "statements": registry.statements(),
+        "slowest_calls": registry.slowest_calls(),
+    }, indent=2, default=str)
+
+
+def to_prometheus():
+    lines = [
+        "# HELP foodwaste_query_duration_seconds Statement wall time.",
+        "# TYPE foodwaste_query_duration_seconds summary",
+    ]
+    statements = registry.statements()
+    for s in statements:
+        label = f'statement="{s["statement_id"]}"'
+        for q in (50, 95, 99):
+            lines.append(f'foodwaste_query_duration_seconds{{{label},quantile="{q / 100}"}} {s[f"p{q}_ms"] / 1000:.6f}')
+        lines.append(f"foodwaste_query_duration_seconds_sum{{{label}}} {s['mean_ms'] * s['count'] / 1000:.6f}")
+        lines.append(f"foodwaste_query_duration_seconds_count{{{label}}} {s['count']}")
+    for name, key, help_text in (
+        ("foodwaste_query_rows_total", "rows", "Rows returned or affected."),
+        ("foodwaste_query_bytes_total", "bytes", "Bytes of result data returned."),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [f'{name}{{statement="{s["statement_id"]}"}} {s[key]}' for s in statements]
+    return "\n".join(lines) + "\n"
+
+
+def export(path):
+    """Write the metrics to ``path``; ``.prom`` files get Prometheus text, anything else JSON."""
+    body = to_prometheus() if path.endswith(".prom") else to_json()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(body)
+    os.replace(tmp, path)
+
+
+def maybe_export():
+    """Export to FOODWASTE_METRICS_FILE if set and the last export is older than the interval."""
+    global _last_export
+    path = os.environ.get("FOODWASTE_METRICS_FILE")
+    now = time.monotonic()
+    if not path or now - _last_export < EXPORT_INTERVAL:
+        return
+    _last_export = now
+    export(path)
@@ -0,0 +1,70 @@
+"""Create the indexes used by the Filter & Contact queries and the matching engine,
+and add columns that newer versions of schema.py have to existing tables.
+
+Usage:
+    python migrate.py [database-url]
+
+The URL defaults to the backend configured for the app (see db.py).
+
+Safe to run repeatedly; indexes and columns that already exist are skipped.
+"""
+import sys
+
+from sqlalchemy import inspect
+from sqlalchemy.types import Text
+
+import archive
+import db
+import metrics
+
+# (index name, table, column or tuple of columns)
+INDEXES = [
+    ("idx_food_listings_location", "food_listings", "Location"),
+    ("idx_food_listings_location_expiry", "food_listings", ("Location", "Expiry_Date")),
+    ("idx_food_listings_provider_id", "food_listings", "Provider_ID"),
+    ("idx_food_listings_food_type", "food_listings", "Food_Type"),
+    ("idx_claims_food_id", "claims", "Food_ID"),
+    ("idx_claims_receiver_id", "claims", "Receiver_ID"),
+    ("idx_providers_name", "providers", "Name"),
+]
+
+# (table, column, SQL type) added since the tables were first created
+COLUMNS = [
+    ("claims", "Quantity", "INTEGER"),
+    ("claims_archive", "Quantity", "INTEGER"),
+]
+
+# MySQL can only index TEXT columns (what DataFrame.to_sql creates) by prefix.
+MYSQL_TEXT_PREFIX = 64
+
+
+def migrate(engine):
+    insp = inspect(engine)
+    created = []
+    with engine.begin() as conn:
+        for table, column, sql_type in COLUMNS:
+            if insp.has_table(table) and column not in {c["name"] for c in insp.get_columns(table)}:
+                metrics.execute(conn, f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}")
+                created.append(f"{table}.{column}")
+        for name, table, columns in INDEXES:
+            if name in {ix["name"] for ix in insp.get_indexes(table)}:
+                continue
+            targets = []
+            for column in columns if isinstance(columns, tuple) else (columns,):
+                target = column
+                if engine.dialect.name == "mysql":
+                    col_type = next(c["type"] for c in insp.get_columns(table) if c["name"] == column)
+                    if isinstance(col_type, Text):
+                        target = f"{column}({MYSQL_TEXT_PREFIX})"
+                targets.append(target)
+            metrics.execute(conn, f"CREATE INDEX {name} ON {table} ({', '.join(targets)})")
+            created.append(name)
+    if archive.enabled(engine):
+        archive.create(engine)  # the hot + archive views pick up the new columns
+    return created
+
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else None
+    for name in migrate(db.create_db_engine(url)):
+        print(f"created {name}")
@@ -0,0 +1,219 @@
+"""The "15 Queries" analytics catalog shown in the app.
+
+Kept in its own module so the benchmark runner and other tools execute
+exactly the SQL the app does. The statements are plain SQL that runs on
+MySQL, SQLite and DuckDB. ``QUERIES`` computes each answer from the base
+tables; ``SUMMARY_QUERIES`` reads the same answers from the summary tables.
+"""
+
+QUERIES = {
+    "Providers and receivers count by city": """
+        SELECT p.City, 
+               COUNT(DISTINCT p.Provider_ID) AS Providers, 
+               COUNT(DISTINCT r.Receiver_ID) AS Receivers
+        FROM providers p
+        LEFT JOIN receivers r ON p.City = r.City
+        GROUP BY p.City;
+    """,
+    "Top food provider type by contributions": """
+        SELECT Provider_Type, COUNT(Food_ID) AS Total_Contributions
+        FROM food_listings
+        GROUP BY Provider_Type
+        ORDER BY Total_Contributions DESC;
+    """,
+    "Provider contact info by city": None,  # parameterized, see PROVIDER_CONTACTS_BY_CITY
+    "Most frequent food receivers": """
+        SELECT r.Name AS Receiver_Name, COUNT(c.Claim_ID) AS Total_Claims
+        FROM claims c
+        JOIN receivers r ON c.Receiver_ID = r.Receiver_ID
+        GROUP BY r.Name
+        ORDER BY Total_Claims DESC;
+    """,
+    "Total food quantity available": """
+        SELECT SUM(Quantity) AS Total_Quantity_Available
+        FROM food_listings;
+    """,
+    "City with highest listings": """
+        SELECT Location AS City, COUNT(Food_ID) AS Total_Listings
+        FROM food_listings
+        GROUP BY Location
+        ORDER BY Total_Listings DESC
+        LIMIT 1;
+    """,
+    "Most common food types": """
+        SELECT Food_Type, COUNT(Food_ID) AS Count
+        FROM food_listings
+        GROUP BY Food_Type
+        ORDER BY Count DESC;
+    """,
+    "Claims per food item": """
+        SELECT f.Food_Name, COUNT(c.Claim_ID) AS Total_Claims
+        FROM claims c
+        JOIN food_listings f ON c.Food_ID = f.Food_ID
+        GROUP BY f.Food_Name
+        ORDER BY Total_Claims DESC;
+    """,
+    "Top provider by successful claims": """
+        SELECT p.Name AS Provider_Name, COUNT(c.Claim_ID) AS Successful_Claims
+        FROM claims c
+        JOIN food_listings f ON c.Food_ID = f.Food_ID
+        JOIN providers p ON f.Provider_ID = p.Provider_ID
+        WHERE c.Status = 'Completed'
+        GROUP BY p.Name
+        ORDER BY Successful_Claims DESC
+        LIMIT 1;
+    """,
+    "Claims status percentages": """
+        SELECT Status,
+               COUNT(*) * 100.0 / (SELECT COUNT(*) FROM claims) AS Percentage
+        FROM claims
+        GROUP BY Status;
+    """,
+    "Avg quantity claimed per receiver": """
+        SELECT r.Name AS Receiver_Name,
+               AVG(COALESCE(c.Quantity, f.Quantity)) AS Avg_Quantity_Claimed
+        FROM claims c
+        JOIN receivers r ON c.Receiver_ID = r.Receiver_ID
+        JOIN food_listings f ON c.Food_ID = f.Food_ID
+        WHERE c.Status = 'Completed'
+        GROUP BY r.Name
+        ORDER BY Avg_Quantity_Claimed DESC;
+    """,
+    "Most claimed meal type": """
+        SELECT f.Meal_Type, COUNT(c.Claim_ID) AS Total_Claims
+        FROM claims c
+        JOIN food_listings f ON c.Food_ID = f.Food_ID
+        GROUP BY f.Meal_Type
+        ORDER BY Total_Claims DESC;
+    """,
+    "Quantity donated per provider": """
+        SELECT p.Name AS Provider_Name, SUM(f.Quantity + COALESCE(h.Held, 0)) AS Total_Quantity_Donated
+        FROM food_listings f
+        JOIN providers p ON f.Provider_ID = p.Provider_ID
+        LEFT JOIN (
+            SELECT Food_ID, SUM(Quantity) AS Held FROM claims
+            WHERE Quantity IS NOT NULL AND (Status IS NULL OR Status <> 'Cancelled')
+            GROUP BY Food_ID
+        ) h ON h.Food_ID = f.Food_ID
+        GROUP BY p.Name
+        ORDER BY Total_Quantity_Donated DESC;
+    """,
+    "Top demand locations": """
+        SELECT f.Location AS City, COUNT(c.Claim_ID) AS Total_Claims
+        FROM claims c
+        JOIN food_listings f ON c.Food_ID = f.Food_ID
+        GROUP BY f.Location
+        ORDER BY Total_Claims DESC
+        LIMIT 5;
+    """,
+    "Most wasted (unclaimed) food types": """
+        SELECT f.Food_Type, COUNT(f.Food_ID) AS Unclaimed_Items
+        FROM food_listings f
+        LEFT JOIN claims c ON f.Food_ID = c.Food_ID
+        WHERE c.Claim_ID IS NULL
+        GROUP BY f.Food_Type
+        ORDER BY Unclaimed_Items DESC;
+    """
+}
+
+PROVIDER_CONTACTS_BY_CITY = "SELECT Name, Contact FROM providers WHERE City = :city"
+
+# The same catalog answered from the summary tables maintained by summaries.py.
+# Each query reads pre-aggregated rows, so its cost no longer grows with claims.
+SUMMARY_QUERIES = {
+    "Providers and receivers count by city": """
+        SELECT City, Providers, Receivers
+        FROM summary_city
+        WHERE Providers > 0;
+    """,
+    "Top food provider type by contributions": """
+        SELECT Provider_Type, Listings AS Total_Contributions
+        FROM summary_provider_type
+        WHERE Listings > 0
+        ORDER BY Total_Contributions DESC;
+    """,
+    "Most frequent food receivers": """
+        SELECT r.Name AS Receiver_Name, SUM(s.Claims) AS Total_Claims
+        FROM summary_receiver s
+        JOIN receivers r ON s.Receiver_ID = r.Receiver_ID
+        WHERE s.Claims > 0
+        GROUP BY r.Name
+        ORDER BY Total_Claims DESC;
+    """,
+    "Total food quantity available": """
+        SELECT Value AS Total_Quantity_Available
+        FROM summary_totals
+        WHERE Metric = 'Quantity';
+    """,
+    "City with highest listings": """
+        SELECT Location AS City, Listings AS Total_Listings
+        FROM summary_location
+        WHERE Listings > 0
+        ORDER BY Total_Listings DESC
+        LIMIT 1;
+    """,
+    "Most common food types": """
+        SELECT Food_Type, Listings AS Count
+        FROM summary_food_type
+        WHERE Listings > 0
+        ORDER BY Count DESC;
+    """,
+    "Claims per food item": """
+        SELECT Food_Name, Claims AS Total_Claims
+        FROM summary_food_name
+        WHERE Claims > 0
+        ORDER BY Total_Claims DESC;
+    """,
+    "Top provider by successful claims": """
+        SELECT p.Name AS Provider_Name, SUM(s.Completed_Claims) AS Successful_Claims
+        FROM summary_provider s
+        JOIN providers p ON s.Provider_ID = p.Provider_ID
+        WHERE s.Completed_Claims > 0
+        GROUP BY p.Name
+        ORDER BY Successful_Claims DESC
+        LIMIT 1;
+    """,
+    "Claims status percentages": """
+        SELECT Status,
+               Claims * 100.0 / (SELECT SUM(Claims) FROM summary_status) AS Percentage
+        FROM summary_status
+        WHERE Claims > 0;
+    """,
+    "Avg quantity claimed per receiver": """
+        SELECT r.Name AS Receiver_Name,
+               SUM(s.Completed_Quantity) * 1.0 / NULLIF(SUM(s.Quantified_Claims), 0) AS Avg_Quantity_Claimed
+        FROM summary_receiver s
+        JOIN receivers r ON s.Receiver_ID = r.Receiver_ID
+        WHERE s.Completed_Claims > 0
+        GROUP BY r.Name
+        ORDER BY Avg_Quantity_Claimed DESC;
+    """,
+    "Most claimed meal type": """
+        SELECT Meal_Type, Claims AS Total_Claims
+        FROM summary_meal_type
+        WHERE Claims > 0
+        ORDER BY Total_Claims DESC;
+    """,
+    "Quantity donated per provider": """
+        SELECT p.Name AS Provider_Name,
+               CASE WHEN SUM(s.Quantified_Listings) > 0 THEN SUM(s.Quantity) END AS Total_Quantity_Donated
+        FROM summary_provider s
+        JOIN providers p ON s.Provider_ID = p.Provider_ID
+        WHERE s.Listings > 0
+        GROUP BY p.Name
+        ORDER BY Total_Quantity_Donated DESC;
+    """,
+    "Top demand locations": """
+        SELECT Location AS City, Claims AS Total_Claims
+        FROM summary_location
+        WHERE Claims > 0
+        ORDER BY Total_Claims DESC
+        LIMIT 5;
+    """,
+    "Most wasted (unclaimed) food types": """
+        SELECT Food_Type, Unclaimed AS Unclaimed_Items
+        FROM summary_food_type
+        WHERE Unclaimed > 0
+        ORDER BY Unclaimed_Items DESC;
+    """,
+}
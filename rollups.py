@@ -0,0 +1,323 @@
+"""Time-bucketed rollups of claims and listing expiry for the Trends view.
+
+``rollup_claims`` counts claims per hour, day and week bucket of their
+Timestamp, broken down by status and by the city, food type and meal type
+of the claimed listing. ``rollup_expiry`` holds the listings and remaining
+quantity expiring on each day, per city. Buckets are stored as ISO text
+(``YYYY-MM-DD HH:MM:SS``, weeks start on Monday), which sorts in time order
+on every backend, and lead the primary keys, so a range query reads only
+the buckets inside its window.
+
+Rollups are maintained alongside the summary tables: :func:`add_deltas` is
+called from ``summaries.apply`` and ``summaries.apply_batch`` in the same
+transaction as every write. Timestamps are parsed leniently, so the
+notebook's ``"3/5/2025 5:26"`` strings are bucketed too; values that do not
+parse are left out. Rows moved to the archive tables by archive.py stay
+counted, so the rollups cover hot and archived history alike.
+
+Usage:
+    python rollups.py rebuild [--url URL]
+    python rollups.py verify [--url URL]
+"""
+import argparse
+import collections
+import datetime
+import sys
+
+import pandas as pd
+from sqlalchemy import Column, Integer, MetaData, String, Table, func, inspect, select, text
+
+import archive
+import db
+import metrics
+import summaries
+
+metadata = MetaData()
+
+GRAINS = ("hour", "day", "week")
+# Dimension -> listing column; "all" counts every claim, with or without a listing.
+DIMENSIONS = {"all": None, "city": "Location", "food_type": "Food_Type", "meal_type": "Meal_Type"}
+
+rollup_claims = Table(
+    "rollup_claims",
+    metadata,
+    Column("Grain", String(8), primary_key=True),
+    Column("Dimension", String(16), primary_key=True),
+    Column("Bucket", String(19), primary_key=True),
+    Column("Value", String(128), primary_key=True),
+    Column("Status", String(16), primary_key=True),
+    Column("Claims", Integer, nullable=False, default=0, server_default=text("0")),
+)
+
+rollup_expiry = Table(
+    "rollup_expiry",
+    metadata,
+    Column("Day", String(10), primary_key=True),
+    Column("Location", String(128), primary_key=True),
+    Column("Listings", Integer, nullable=False, default=0, server_default=text("0")),
+    Column("Quantity", Integer, nullable=False, default=0, server_default=text("0")),
+)
+
+_enabled = {}
+
+
+def enabled(engine):
+    """Whether the rollup tables exist (only a yes is kept, see summaries.enabled)."""
+    key = str(engine.url)
+    if not _enabled.get(key):
+        _enabled[key] = all(inspect(engine).has_table(t) for t in metadata.tables)
+    return _enabled[key]
+
+
+def _timestamp(value):
+    if value is None or value == "":
+        return None
+    try:
+        ts = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        return None
+    return None if pd.isna(ts) else ts
+
+
+def bucket(value, grain):
+    """Start of the ``grain`` bucket holding ``value``, as ISO text (None if unparseable)."""
+    ts = _timestamp(value)
+    if ts is None:
+        return None
+    if grain == "hour":
+        start = ts.floor("h")
+    elif grain == "day":
+        start = ts.normalize()
+    else:
+        start = ts.normalize() - pd.Timedelta(days=ts.weekday())
+    return start.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _day(value):
+    ts = _timestamp(value)
+    return None if ts is None else ts.strftime("%Y-%m-%d")
+
+
+def _claim_delta(deltas, claim, listing, sign):
+    status = claim["Status"] or ""
+    for grain in GRAINS:
+        start = bucket(claim["Timestamp"], grain)
+        if start is None:
+            return
+        for dimension, column in DIMENSIONS.items():
+            if column is None:
+                value = ""
+            elif listing is None or listing[column] is None:
+                continue
+            else:
+                value = listing[column]
+            deltas.add(rollup_claims, (grain, dimension, start, value, status), Claims=sign)
+
+
+def _expiry_delta(deltas, listing, sign):
+    day = _day(listing["Expiry_Date"])
+    if day is not None and listing["Location"] is not None:
+        deltas.add(rollup_expiry, (day, listing["Location"]),
+                   Listings=sign, Quantity=sign * (listing["Quantity"] or 0))
+
+
+def _dimensions_changed(old, new):
+    return old is None or new is None or any(old[c] != new[c] for c in DIMENSIONS.values() if c)
+
+
+def add_deltas(conn, deltas, table, old, new):
+    """Add the rollup changes for one row of ``table`` going from ``old`` to ``new``.
+
+    Called by summaries.apply after the base table was changed.
+    """
+    if not enabled(conn.engine):
+        return
+    if table == "food_listings":
+        if old is not None:
+            _expiry_delta(deltas, old, -1)
+        if new is not None:
+            _expiry_delta(deltas, new, 1)
+        # A listing's claims move with it when its city, food or meal type changes.
+        if _dimensions_changed(old, new):
+            for claim in summaries.claims_of(conn, (old or new)["Food_ID"]):
+                if old is not None:
+                    _claim_delta(deltas, claim, old, -1)
+                if new is not None:
+                    _claim_delta(deltas, claim, new, 1)
+    elif table == "claims":
+        for row, sign in ((old, -1), (new, 1)):
+            if row is not None:
+                _claim_delta(deltas, row, summaries.fetch_listing(conn, row["Food_ID"]), sign)
+
+
+def add_batch_deltas(conn, deltas, table, rows, sign):
+    """Rollup changes for the rows of a batch write; see summaries.apply_batch."""
+    if not enabled(conn.engine):
+        return
+    for row in rows:
+        if table == "food_listings":
+            add_deltas(conn, deltas, table, row if sign < 0 else None, row if sign > 0 else None)
+        elif table == "claims":
+            _claim_delta(deltas, row, summaries.fetch_listing(conn, row["Food_ID"]), sign)
+
+
+def _floor(ts, grain):
+    """Bucket starts for a Series of timestamps (the vector form of :func:`bucket`)."""
+    if grain == "hour":
+        start = ts.dt.floor("h")
+    elif grain == "day":
+        start = ts.dt.normalize()
+    else:
+        start = ts.dt.normalize() - pd.to_timedelta(ts.dt.weekday, unit="D")
+    return start.dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _expiry_chunk(deltas, listings):
+    days = pd.to_datetime(listings["Expiry_Date"], format="mixed", errors="coerce").dt.strftime("%Y-%m-%d")
+    expiry = (
+        listings.assign(Day=days, Quantity=pd.to_numeric(listings["Quantity"]).fillna(0))
+        .dropna(subset=["Day", "Location"])
+        .groupby(["Day", "Location"])
+        .agg(Listings=("Day", "size"), Quantity=("Quantity", "sum"))
+    )
+    for (day, location), row in expiry.iterrows():
+        deltas.add(rollup_expiry, (day, location), Listings=int(row["Listings"]), Quantity=int(row["Quantity"]))
+
+
+def _claims_chunk(deltas, claims):
+    ts = pd.to_datetime(claims["Timestamp"], format="mixed", errors="coerce")
+    claims, ts = claims[ts.notna()], ts[ts.notna()]
+    status = claims["Status"].fillna("")
+    for grain in GRAINS:
+        starts = _floor(ts, grain)
+        for dimension, column in DIMENSIONS.items():
+            values = pd.Series("", index=claims.index) if column is None else claims[column]
+            counts = (
+                pd.DataFrame({"Bucket": starts, "Value": values, "Status": status})
+                .dropna()
+                .groupby(["Bucket", "Value", "Status"])
+                .size()
+            )
+            for (start, value, status_), n in counts.items():
+                deltas.add(rollup_claims, (grain, dimension, start, value, status_), Claims=int(n))
+
+
+def _computed(engine):
+    """Every rollup row recomputed from the base tables, as a summaries.Deltas.
+
+    The base rows are streamed (see metrics.stream) and each chunk is folded
+    into the Deltas, so memory grows with the number of buckets, not rows.
+    """
+    deltas = summaries.Deltas()
+    listings = archive.history(engine, "food_listings")
+    with engine.connect() as conn:
+        for chunk in metrics.stream(conn, f"SELECT Quantity, Expiry_Date, Location FROM {listings}",
+                                    view_name="rollups rebuild"):
+            _expiry_chunk(deltas, chunk)
+        sql = (
+            "SELECT c.Status, c.Timestamp, f.Location, f.Food_Type, f.Meal_Type "
+            f"FROM {archive.history(engine, 'claims')} c LEFT JOIN {listings} f ON c.Food_ID = f.Food_ID"
+        )
+        for chunk in metrics.stream(conn, sql, view_name="rollups rebuild"):
+            _claims_chunk(deltas, chunk)
+    return deltas
+
+
+def rebuild(engine):
+    """Recreate the rollup tables from the base tables in one transaction."""
+    metadata.create_all(engine)
+    deltas = _computed(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            metrics.execute(conn, table.delete())
+        deltas.flush(conn)
+    _enabled[str(engine.url)] = True
+
+
+def verify(engine):
+    """Names of the rollup tables whose rows differ from a fresh recomputation."""
+    expected = collections.defaultdict(dict)
+    for (table, key), counters in _computed(engine).rows.items():
+        counters = {c: v for c, v in counters.items() if v}
+        if counters:
+            expected[table.name][key] = counters
+    mismatched = []
+    for table in metadata.sorted_tables:
+        key_cols = [c.name for c in table.primary_key]
+        actual = {}
+        for row in metrics.read_sql(select(table), engine).to_dict("records"):
+            counters = {c: int(row[c]) for c in row if c not in key_cols and row[c]}
+            if counters:
+                actual[tuple(row[c] for c in key_cols)] = counters
+        if actual != expected[table.name]:
+            mismatched.append(table.name)
+    return mismatched
+
+
+def claim_trend(engine, grain, start, end, dimension="all", values=None):
+    """Claims per bucket, value and status for buckets starting in ``[start, end)``."""
+    if grain not in GRAINS or dimension not in DIMENSIONS:
+        raise ValueError(f"unknown grain {grain!r} or dimension {dimension!r}")
+    query = (
+        select(rollup_claims.c.Bucket, rollup_claims.c.Value, rollup_claims.c.Status,
+               rollup_claims.c.Claims)
+        .where(rollup_claims.c.Grain == grain, rollup_claims.c.Dimension == dimension,
+               rollup_claims.c.Bucket >= bucket(start, grain), rollup_claims.c.Bucket < _iso(end),
+               rollup_claims.c.Claims != 0)
+        .order_by(rollup_claims.c.Bucket)
+    )
+    if values:
+        query = query.where(rollup_claims.c.Value.in_(list(values)))
+    return metrics.read_sql(query, engine)
+
+
+def upcoming_expiry(engine, start, days):
+    """Listings and quantity expiring per day and city in the ``days`` days from ``start``."""
+    first = pd.Timestamp(start)
+    query = (
+        select(rollup_expiry)
+        .where(rollup_expiry.c.Day >= first.strftime("%Y-%m-%d"),
+               rollup_expiry.c.Day < (first + pd.Timedelta(days=days)).strftime("%Y-%m-%d"),
+               rollup_expiry.c.Listings != 0)
+        .order_by(rollup_expiry.c.Day, rollup_expiry.c.Location)
+    )
+    return metrics.read_sql(query, engine)
+
+
+def claim_span(engine):
+    """First and last day with claims as dates, or ``(None, None)``."""
+    query = select(func.min(rollup_claims.c.Bucket), func.max(rollup_claims.c.Bucket)).where(
+        rollup_claims.c.Grain == "day", rollup_claims.c.Dimension == "all"
+    )
+    first, last = metrics.read_sql(query, engine).iloc[0]
+    if first is None:
+        return None, None
+    return pd.Timestamp(first).date(), pd.Timestamp(last).date()
+
+
+def _iso(value):
+    return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the time-bucketed rollup tables.")
+    parser.add_argument("command", choices=("rebuild", "verify"))
+    parser.add_argument("--url", help="SQLAlchemy database URL (default: the backend configured in db.py)")
+    args = parser.parse_args(argv)
+
+    engine = db.create_db_engine(args.url)
+    if args.command == "rebuild":
+        started = datetime.datetime.now()
+        rebuild(engine)
+        print(f"rollup tables rebuilt in {(datetime.datetime.now() - started).total_seconds():.1f}s")
+        return
+    mismatched = verify(engine)
+    for name in mismatched:
+        print(f"MISMATCH {name}")
+    if mismatched:
+        sys.exit(1)
+    print("rollup tables match the base tables")
+
+
+if __name__ == "__main__":
+    main()
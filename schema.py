@@ -0,0 +1,79 @@
+"""Typed table definitions for the Foodwaste database.
+
+Used by loader.py to create the tables with primary keys, foreign keys and
+the indexes the app's queries rely on (see also migrate.py, which adds the
+same indexes to databases created by the notebook's ``to_sql`` calls).
+"""
+from sqlalchemy import (
+    Column,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+)
+
+metadata = MetaData()
+
+providers = Table(
+    "providers",
+    metadata,
+    Column("Provider_ID", Integer, primary_key=True),
+    Column("Name", String(255)),
+    Column("Type", String(64)),
+    Column("Address", String(512)),
+    Column("City", String(128)),
+    Column("Contact", String(64)),
+    Index("idx_providers_name", "Name"),
+    Index("idx_providers_city", "City"),
+)
+
+receivers = Table(
+    "receivers",
+    metadata,
+    Column("Receiver_ID", Integer, primary_key=True),
+    Column("Name", String(255)),
+    Column("Type", String(64)),
+    Column("City", String(128)),
+    Column("Contact", String(64)),
+    Index("idx_receivers_city", "City"),
+)
+
+food_listings = Table(
+    "food_listings",
+    metadata,
+    Column("Food_ID", Integer, primary_key=True),
+    Column("Food_Name", String(128)),
+    Column("Quantity", Integer),
+    Column("Expiry_Date", Date),
+    Column("Provider_ID", Integer, ForeignKey("providers.Provider_ID")),
+    Column("Provider_Type", String(64)),
+    Column("Location", String(128)),
+    Column("Food_Type", String(64)),
+    Column("Meal_Type", String(64)),
+    Index("idx_food_listings_location", "Location"),
+    Index("idx_food_listings_provider_id", "Provider_ID"),
+    Index("idx_food_listings_food_type", "Food_Type"),
+    Index("idx_food_listings_expiry_date", "Expiry_Date"),
+    Index("idx_food_listings_location_expiry", "Location", "Expiry_Date"),
+)
+
+claims = Table(
+    "claims",
+    metadata,
+    Column("Claim_ID", Integer, primary_key=True),
+    Column("Food_ID", Integer, ForeignKey("food_listings.Food_ID")),
+    Column("Receiver_ID", Integer, ForeignKey("receivers.Receiver_ID")),
+    Column("Quantity", Integer),  # taken off the listing while the claim is not cancelled
+    Column("Status", String(16)),
+    Column("Timestamp", DateTime),
+    Index("idx_claims_food_id", "Food_ID"),
+    Index("idx_claims_receiver_id", "Receiver_ID"),
+    Index("idx_claims_status", "Status"),
+)
+
+# Parents before children, which is also the order CSVs must be loaded in.
+TABLES = [providers, receivers, food_listings, claims]
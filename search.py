@@ -0,0 +1,297 @@
+"""Typeahead search over providers, receivers, food listings and claims.
+
+Each table gets a process-wide in-memory index, built from the database the
+first time it is searched. Text fields (names, cities, food names) are
+indexed by trigram, plus the first one or two letters of every word, so
+short prefixes, substrings and near misses all match and only the top few
+results are ever sent to the browser. IDs are looked up by prefix in the
+database, so claims (which have no text to search) need no index at all.
+
+crud.py and archive.py call :func:`refresh` after every write, so the index
+follows this process's changes row by row. Only writes that change indexed
+text bump the index's own version in versions.py (stock moves and claims do
+not), and each index remembers the version it is current with; when the
+version moves on because another process changed indexed text, a new index
+is built while the old one keeps answering. Versions are checked at most once
+every ``FOODWASTE_CACHE_VERSION_CHECK`` seconds.
+"""
+import collections
+import heapq
+import re
+import threading
+
+from sqlalchemy import bindparam, text
+
+import metrics
+import table_cache
+import versions
+
+LIMIT = 10
+MIN_SCORE = 0.4
+
+# ID prefixes are matched against keys of up to this many digits.
+ID_DIGITS = 10
+
+# Refreshing more keys than this rebuilds the index instead.
+REFRESH_LIMIT = 500
+
+# table -> (primary key, indexed text fields)
+FIELDS = {
+    "providers": ("Provider_ID", ("Name", "City")),
+    "receivers": ("Receiver_ID", ("Name", "City")),
+    "food_listings": ("Food_ID", ("Food_Name", "Location")),
+    "claims": ("Claim_ID", ()),
+}
+
+
+def _normalize(value):
+    return re.sub(r"\s+", " ", str(value).lower()).strip()
+
+
+def _grams(value):
+    """Trigrams of ``value`` plus padded one- and two-letter word prefixes."""
+    grams = {value[i:i + 3] for i in range(len(value) - 2)}
+    for word in value.split():
+        grams.add("  " + word[:1])
+        grams.add(" " + word[:2])
+    return grams
+
+
+def _query_grams(query):
+    if len(query) < 3:
+        return {("  " if len(query) == 1 else " ") + query}
+    return {query[i:i + 3] for i in range(len(query) - 2)}
+
+
+class SearchIndex:
+    def __init__(self, table):
+        self.table = table
+        self.key, self.fields = FIELDS[table]
+        self._lock = threading.Lock()
+        self._rows = {}  # key -> {field: value}
+        self._values = {field: collections.defaultdict(set) for field in self.fields}  # value -> keys
+        self._grams = collections.defaultdict(set)  # gram -> {(field, value)}
+        self._max_key = 0
+        self.version = None  # table version the index is current with
+
+    def _columns(self):
+        return ", ".join((self.key, *self.fields))
+
+    def load(self, engine):
+        # The version is read first, so a write landing during the load makes
+        # the index look older than it is, never newer.
+        self.version = _version(engine, self.table)
+        frame = metrics.read_sql(f"SELECT {self._columns()} FROM {self.table}", engine, view_name="search index")
+        with self._lock:
+            for row in frame.to_dict("records"):
+                self._add(row)
+
+    def _values_of(self, row):
+        return {f: row[f] for f in self.fields if isinstance(row[f], str) and row[f].strip()}
+
+    def _add(self, row):
+        key = int(row[self.key])
+        values = self._values_of(row)
+        self._rows[key] = values
+        self._max_key = max(self._max_key, key)
+        for field, value in values.items():
+            keys = self._values[field][value]
+            if not keys:
+                for gram in _grams(_normalize(value)):
+                    self._grams[gram].add((field, value))
+            keys.add(key)
+
+    def _remove(self, key):
+        for field, value in self._rows.pop(key, {}).items():
+            keys = self._values[field][value]
+            keys.discard(key)
+            if not keys:
+                del self._values[field][value]
+                for gram in _grams(_normalize(value)):
+                    self._grams[gram].discard((field, value))
+
+    def read(self, engine, keys):
+        """Rows for ``keys`` and any newer than the newest indexed one, as of now."""
+        sql = text(
+            f"SELECT {self._columns()} FROM {self.table} WHERE {self.key} > :max_key OR {self.key} IN :keys"
+        ).bindparams(bindparam("keys", expanding=True))
+        frame = metrics.read_sql(sql, engine, params={"max_key": self._max_key, "keys": keys},
+                                 view_name="search refresh")
+        return frame.to_dict("records")
+
+    def changed(self, keys, rows):
+        """Whether ``rows`` (as read for ``keys``) differ from the indexed text."""
+        found = {int(row[self.key]): self._values_of(row) for row in rows}
+        with self._lock:
+            return any(found.get(key) != self._rows.get(key) for key in {*keys, *found})
+
+    def apply(self, keys, rows):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+            for row in rows:
+                self._remove(int(row[self.key]))
+                self._add(row)
+
+    def _ranked_values(self, query, fields, limit):
+        """``(field, value)`` pairs best matching ``query``, best first."""
+        query = _normalize(query)
+        wanted = _query_grams(query)
+        with self._lock:
+            hits = collections.Counter()
+            for gram in wanted:
+                hits.update(self._grams.get(gram, ()))
+            scored = []
+            for (field, value), shared in hits.items():
+                if field not in fields:
+                    continue
+                score = shared / len(wanted)
+                normalized = _normalize(value)
+                if normalized.startswith(query):
+                    score += 1
+                elif query in normalized:
+                    score += 0.5
+                if score >= MIN_SCORE:
+                    scored.append((-score, len(value), value, field))
+        return [(field, value) for _, _, value, field in heapq.nsmallest(limit, scored)]
+
+    def suggest(self, field, query, limit):
+        """Distinct values of ``field`` matching ``query``; the most used ones if it is empty."""
+        if not query.strip():
+            with self._lock:
+                counts = [(len(keys), value) for value, keys in self._values[field].items()]
+            return [value for _, value in sorted(counts, key=lambda c: (-c[0], c[1]))[:limit]]
+        return [value for _, value in self._ranked_values(query, (field,), limit)]
+
+    def find(self, query, limit):
+        """Primary keys of the rows whose text best matches ``query``."""
+        keys = []
+        for field, value in self._ranked_values(query, self.fields, limit):
+            with self._lock:
+                matches = sorted(self._values[field].get(value, ()))
+            keys += [k for k in matches if k not in keys]
+            if len(keys) >= limit:
+                break
+        return keys[:limit]
+
+    def label(self, key):
+        with self._lock:
+            values = self._rows.get(key, {})
+        text_ = " · ".join(values[f] for f in self.fields if f in values)
+        return f"{key} · {text_}" if text_ else str(key)
+
+
+_indexes = {}
+_building = {}  # name -> lock held while that index is built
+_indexes_lock = threading.Lock()
+
+
+def _version(engine, table, max_age=0.0):
+    return versions.current(engine, max_age).get(versions.INDEXES[table], (0, None))[0]
+
+
+def index(engine, table):
+    """The shared index for ``table``, built on first use and rebuilt once its text changed elsewhere.
+
+    Builds run outside the lock guarding every index, one per table at a
+    time; while one runs, other searches keep using the index it replaces.
+    """
+    name = (str(engine.url), table)
+    version = _version(engine, table, table_cache.VERSION_CHECK)
+    with _indexes_lock:
+        idx = _indexes.get(name)
+        building = _building.setdefault(name, threading.Lock())
+    if idx is not None and idx.version == version:
+        return idx
+    if not building.acquire(blocking=idx is None):
+        return idx
+    try:
+        with _indexes_lock:
+            latest = _indexes.get(name)
+        if latest is not None and latest.version is not None and latest.version >= version:
+            return latest  # built while this thread waited
+        idx = SearchIndex(table)
+        idx.load(engine)
+        with _indexes_lock:
+            _indexes[name] = idx
+        return idx
+    finally:
+        building.release()
+
+
+def refresh(engine, table, keys=()):
+    """Bring ``table``'s index up to date after a write to ``keys``.
+
+    The rows are re-read and compared with the index; only if their indexed
+    text changed is the index's version bumped and the change applied (with
+    no index in this process there is nothing to compare, so it is always
+    bumped). If the version moved by more than that one bump, another process
+    changed text as well: the rows are still applied, but the index is left
+    behind its version, so the next search builds a new one.
+    """
+    if not FIELDS[table][1]:
+        return
+    name = (str(engine.url), table)
+    keys = sorted({int(k) for k in keys})
+    with _indexes_lock:
+        idx = _indexes.get(name)
+    if idx is None or len(keys) > REFRESH_LIMIT:
+        versions.bump(engine, versions.INDEXES[table])
+        return
+    rows = idx.read(engine, keys)
+    if not idx.changed(keys, rows):
+        return
+    versions.bump(engine, versions.INDEXES[table])
+    version = _version(engine, table)
+    idx.apply(keys, rows)
+    if idx.version is not None and version == idx.version + 1:
+        idx.version = version
+
+
+def reset():
+    """Drop every index; each is rebuilt from the database on its next search."""
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def _ids(engine, table, digits, limit):
+    """Keys that start with ``digits`` (12, 120-129, 1200-1299, ...) in that order."""
+    key, _ = FIELDS[table]
+    if len(digits) > ID_DIGITS:
+        return []
+    if not digits:
+        sql, params = f"SELECT {key} FROM {table} ORDER BY {key} LIMIT :limit", {}
+    else:
+        prefix = int(digits)
+        ranges = [(prefix * 10 ** n, (prefix + 1) * 10 ** n - 1) for n in range(ID_DIGITS - len(digits) + 1)]
+        where = " OR ".join(f"{key} BETWEEN :lo{n} AND :hi{n}" for n in range(len(ranges)))
+        params = {f"{bound}{n}": v for n, r in enumerate(ranges) for bound, v in zip(("lo", "hi"), r)}
+        sql = f"SELECT {key} FROM {table} WHERE {where} ORDER BY {key} LIMIT :limit"
+    frame = metrics.read_sql(sql, engine, params={**params, "limit": limit}, view_name="search ids")
+    return [int(k) for k in frame[key]]
+
+
+def find(engine, table, query, limit=LIMIT):
+    """``[(key, label)]`` for the rows of ``table`` best matching ``query``.
+
+    An empty or all-digit query matches IDs (from the database, so tables
+    without text fields need no index); text is looked up in the index.
+    """
+    _, fields = FIELDS[table]
+    query = query.strip()
+    keys = _ids(engine, table, query, limit) if not query or query.isdigit() else []
+    if fields and query and len(keys) < limit:
+        keys += [k for k in index(engine, table).find(query, limit) if k not in keys]
+    return [(key, label(engine, table, key)) for key in keys[:limit]]
+
+
+def label(engine, table, key):
+    """``"key · name · city"`` for the row with primary key ``key``."""
+    if not FIELDS[table][1]:
+        return str(key)
+    return index(engine, table).label(int(key))
+
+
+def suggest(engine, table, field, query, limit=LIMIT):
+    """Distinct values of ``table.field`` best matching ``query``."""
+    return index(engine, table).suggest(field, query, limit)
@@ -0,0 +1,284 @@
+"""Randomized consistency checks for the incrementally maintained tables.
+
+Usage:
+    python selfcheck.py summaries --url URL [--ops 200] [--seed 7]
+    python selfcheck.py claims --url URL [--workers 8] [--ops 400] [--seed 7]
+    python selfcheck.py archive --url URL [--retention-days 30]
+
+Every check writes to the database, so point ``--url`` at a scratch copy,
+e.g. one made with ``python loader.py --url sqlite:///check.db --mode replace``.
+A check prints what it found and exits with status 1 on a failure.
+
+``summaries`` runs ``--ops`` random writes through crud.py and matching.py
+(single rows, bulk imports, bulk deletes, status changes and claims) and,
+after each one, compares the summary and rollup tables with what a rebuild
+from the base tables gives (summaries.verify, rollups.verify).
+
+``claims`` has ``--workers`` threads claim, add, change, cancel and delete
+claims on the same few listings at once, then checks that no listing went
+below zero and that each listing's Quantity plus what its claims hold is
+what it was before. Deleting the claims it made must give every listing its
+Quantity back.
+
+``archive`` sweeps expired listings into the archive and checks that the
+hot + archive views hold exactly the rows they held before, that no key is
+both hot and archived, that the summary and rollup tables still match, and
+that a new listing and claim get keys above every archived one.
+"""
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import random
+import sys
+import threading
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import archive
+import crud
+import db
+import matching
+import metrics
+import rollups
+import summaries
+
+LOCATIONS = ("Check A", "Check B", "Check C")
+
+
+def _keys(engine, table):
+    pk, _ = crud.TABLES[table]
+    return metrics.read_sql(f"SELECT {pk} FROM {table}", engine)[pk].tolist()
+
+
+def _listing(rnd, provider_ids):
+    return {
+        "Food_Name": rnd.choice(("Rice", "Bread", "Soup")), "Quantity": rnd.randint(1, 50),
+        "Expiry_Date": datetime.date(2025, 3, rnd.randint(1, 28)), "Provider_ID": rnd.choice(provider_ids),
+        "Provider_Type": "Restaurant", "Location": rnd.choice(LOCATIONS),
+        "Food_Type": rnd.choice(("Vegetarian", "Vegan")), "Meal_Type": rnd.choice(("Lunch", "Dinner")),
+    }
+
+
+def _claim(rnd, food_ids, receiver_ids):
+    return {
+        "Food_ID": rnd.choice(food_ids), "Receiver_ID": rnd.choice(receiver_ids),
+        "Quantity": rnd.choice((None, 1, 2, 5)), "Status": rnd.choice(crud.CLAIM_STATUSES),
+        "Timestamp": datetime.datetime(2025, 3, rnd.randint(1, 28), rnd.randint(0, 23), 5),
+    }
+
+
+def _write(engine, rnd):
+    """One random write; returns its name."""
+    provider_ids, receiver_ids = _keys(engine, "providers"), _keys(engine, "receivers")
+    food_ids, claim_ids = _keys(engine, "food_listings"), _keys(engine, "claims")
+    op = rnd.choice(("insert", "update", "delete", "import", "import update", "delete many",
+                     "claim status", "claim"))
+    table = rnd.choice(("food_listings", "claims"))
+    keys = food_ids if table == "food_listings" else claim_ids
+    name = op if op.startswith("claim") else f"{op} {table}"
+
+    def row():
+        return _listing(rnd, provider_ids) if table == "food_listings" else _claim(rnd, food_ids, receiver_ids)
+
+    # Rejected writes (a listing with claims, a claim its listing cannot cover)
+    # must leave everything as it was, so they are part of the check too.
+    try:
+        if op == "insert":
+            crud.insert(engine, table, row())
+        elif op == "update":
+            crud.update(engine, table, rnd.choice(keys), row())
+        elif op == "delete":
+            crud.delete(engine, table, rnd.choice(keys))
+        elif op == "import":
+            crud.import_rows(engine, table, [row() for _ in range(8)], skip_invalid=rnd.random() < 0.5)
+        elif op == "import update":
+            pk, columns = crud.TABLES[table]
+            changed = [{pk: key, **{c: v for c, v in row().items() if rnd.random() < 0.4 and c in columns}}
+                       for key in rnd.sample(keys, min(10, len(keys)))]
+            crud.import_rows(engine, table, changed, skip_invalid=rnd.random() < 0.5)
+        elif op == "delete many":
+            crud.delete_many(engine, table, rnd.sample(keys, min(10, len(keys))), skip_invalid=True)
+        elif op == "claim status":
+            crud.set_claim_status(engine, rnd.sample(claim_ids, min(15, len(claim_ids))),
+                                  rnd.choice(crud.CLAIM_STATUSES), skip_invalid=True)
+        else:
+            matching.claim(engine, rnd.choice(receiver_ids), rnd.randint(1, 5),
+                           city=rnd.choice(LOCATIONS + (None,)), as_of=datetime.date(2025, 3, 1))
+    except (ValueError, LookupError) as exc:
+        return f"{name} (rejected: {exc})"
+    except IntegrityError:
+        return f"{name} (rejected by the database)"
+    return name
+
+
+def check_summaries(engine, ops=200, seed=7):
+    """Random writes, verifying the summary and rollup tables after each; returns the failures."""
+    if not summaries.enabled(engine):
+        summaries.rebuild(engine)
+    if not rollups.enabled(engine):
+        rollups.rebuild(engine)
+    rnd = random.Random(seed)
+    for i in range(1, ops + 1):
+        op = _write(engine, rnd)
+        mismatched = summaries.verify(engine) + rollups.verify(engine)
+        if mismatched:
+            return [f"after write {i} ({op}): {name} differs from a rebuild" for name in mismatched]
+    return []
+
+
+def _stock(engine, food_ids):
+    """``{food_id: (Quantity, quantity its claims hold)}`` for ``food_ids``."""
+    quantities = dict(metrics.read_sql("SELECT Food_ID, Quantity FROM food_listings", engine).values.tolist())
+    held = collections.Counter()
+    for claim in metrics.read_sql("SELECT Food_ID, Quantity, Status FROM claims", engine).to_dict("records"):
+        if claim["Quantity"] is not None and claim["Quantity"] == claim["Quantity"]:  # not NaN
+            held.update(matching.holds({**claim, "Quantity": int(claim["Quantity"])}))
+    return {f: (int(quantities[f]), held[f]) for f in food_ids}
+
+
+def check_claims(engine, workers=8, ops=400, seed=7):
+    """Concurrent claim writes on a few listings; returns the failures."""
+    listings = metrics.read_sql(
+        "SELECT Food_ID, Expiry_Date FROM food_listings WHERE Quantity > 0 ORDER BY Quantity, Food_ID LIMIT 5",
+        engine)
+    food_ids = [int(f) for f in listings["Food_ID"]]
+    as_of = min(listings["Expiry_Date"])
+    receiver_ids = _keys(engine, "receivers")
+    before = _stock(engine, food_ids)
+    made, lock = [], threading.Lock()
+    outcomes = collections.Counter()
+
+    def one(i):
+        rnd = random.Random(seed * 100_003 + i)
+        food_id, quantity = rnd.choice(food_ids), rnd.randint(1, 3)
+        op = rnd.choice(("claim", "insert", "update", "cancel", "delete"))
+        with lock:
+            mine = list(made)
+        try:
+            if op == "claim":
+                allocation = matching.claim(engine, rnd.choice(receiver_ids), quantity, food_id=food_id,
+                                            as_of=as_of)
+                if allocation.claim_id is None:
+                    return "claim: nothing left"
+                claim_id = allocation.claim_id
+            elif op == "insert" or not mine:
+                claim_id = crud.insert(engine, "claims", {
+                    "Food_ID": food_id, "Receiver_ID": rnd.choice(receiver_ids), "Quantity": quantity,
+                    "Status": "Pending", "Timestamp": datetime.datetime.now().replace(microsecond=0)})
+            else:
+                claim_id = rnd.choice(mine)
+                row = crud.fetch(engine, "claims", claim_id)
+                if row is None:
+                    return f"{op}: already deleted"
+                if op == "delete":
+                    crud.delete(engine, "claims", claim_id)
+                    return op
+                row.pop("Claim_ID")
+                if op == "cancel":
+                    row["Status"] = "Cancelled" if row["Status"] != "Cancelled" else "Pending"
+                else:
+                    row.update(Food_ID=food_id, Quantity=quantity)
+                crud.update(engine, "claims", claim_id, row)
+                return op
+        except ValueError:
+            return f"{op}: rejected, too little left"
+        except OperationalError:
+            return f"{op}: database busy"
+        with lock:
+            made.append(claim_id)
+        return op
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        outcomes.update(pool.map(one, range(ops)))
+    for outcome, count in sorted(outcomes.items()):
+        print(f"  {outcome}: {count}")
+
+    failures = []
+    after = _stock(engine, food_ids)
+    for food_id in food_ids:
+        quantity, held = after[food_id]
+        if quantity < 0:
+            failures.append(f"listing {food_id} went below zero ({quantity})")
+        if quantity + held != sum(before[food_id]):
+            failures.append(f"listing {food_id}: Quantity {quantity} + held {held} != {sum(before[food_id])} before")
+    crud.delete_many(engine, "claims", made, skip_invalid=True)
+    restored = _stock(engine, food_ids)
+    failures += [f"listing {f}: Quantity {restored[f][0]} after deleting the claims, {before[f][0]} before"
+                 for f in food_ids if restored[f][0] != before[f][0]]
+    return failures
+
+
+def _history(engine):
+    """``{view: rows}`` of the hot + archive views, in key order."""
+    found = {}
+    for table, (_, view) in archive.ARCHIVED.items():
+        pk, _ = crud.TABLES[table]
+        found[view] = metrics.read_sql(f"SELECT * FROM {view} ORDER BY {pk}", engine).reset_index(drop=True)
+    return found
+
+
+def check_archive(engine, retention_days=archive.RETENTION_DAYS):
+    """Sweep, then compare the history before and after; returns the failures."""
+    archive.create(engine)
+    before, counts = _history(engine), archive.counts(engine)
+    result = archive.sweep(engine, retention_days, pause=0)
+    print(f"  archived {result.listings} listings and {result.claims} claims in {result.batches} batches")
+
+    failures = [f"{view} changed in the sweep" for view, rows in _history(engine).items()
+                if not rows.equals(before[view])]
+    for table, (hot, archived) in archive.counts(engine).items():
+        moved = result.listings if table == "food_listings" else result.claims
+        if (hot, archived) != (counts[table][0] - moved, counts[table][1] + moved):
+            failures.append(f"{table}: {hot} hot and {archived} archived rows after moving {moved}")
+        pk, _ = crud.TABLES[table]
+        twins = metrics.read_sql(
+            f"SELECT COUNT(*) AS n FROM {table} WHERE {pk} IN (SELECT {pk} FROM {archive.ARCHIVED[table][0]})",
+            engine)["n"].iloc[0]
+        if twins:
+            failures.append(f"{table}: {twins} keys are both hot and archived")
+    failures += [f"{name} differs from a rebuild" for name in summaries.verify(engine) + rollups.verify(engine)]
+
+    # New rows must not take a key that was archived.
+    listing = crud.fetch(engine, "food_listings", _keys(engine, "food_listings")[0])
+    food_id = crud.insert(engine, "food_listings", {c: listing[c] for c in crud.TABLES["food_listings"][1]})
+    claim_id = crud.insert(engine, "claims", {
+        "Food_ID": food_id, "Receiver_ID": _keys(engine, "receivers")[0], "Quantity": None,
+        "Status": "Pending", "Timestamp": datetime.datetime.now().replace(microsecond=0)})
+    for table, key in (("food_listings", food_id), ("claims", claim_id)):
+        pk, _ = crud.TABLES[table]
+        highest = metrics.read_sql(f"SELECT MAX({pk}) AS k FROM {archive.ARCHIVED[table][0]}", engine)["k"].iloc[0]
+        if highest == highest and key <= highest:  # not NaN: something was archived
+            failures.append(f"new {table} row got {pk}={key}, not above the archived {highest}")
+    crud.delete(engine, "claims", claim_id)
+    crud.delete(engine, "food_listings", food_id)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Randomized consistency checks (they write to the database).")
+    parser.add_argument("command", choices=("summaries", "claims", "archive"))
+    parser.add_argument("--url", required=True, help="SQLAlchemy URL of a scratch database")
+    parser.add_argument("--ops", type=int, help="random writes to run (default: 200 for summaries, 400 for claims)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+    parser.add_argument("--workers", type=int, default=8, help="claims: concurrent writers")
+    parser.add_argument("--retention-days", type=int, default=archive.RETENTION_DAYS,
+                        help="archive: sweep listings this many days past their expiry date")
+    args = parser.parse_args(argv)
+
+    engine = db.create_db_engine(args.url)
+    if args.command == "summaries":
+        failures = check_summaries(engine, args.ops or 200, args.seed)
+    elif args.command == "claims":
+        failures = check_claims(engine, args.workers, args.ops or 400, args.seed)
+    else:
+        failures = check_archive(engine, args.retention_days)
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+    print(f"{args.command}: ok")
+
+
+if __name__ == "__main__":
+    main()
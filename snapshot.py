@@ -0,0 +1,166 @@
+"""Compact columnar copies of the four tables.
+
+:func:`compact` shrinks a table's DataFrame: low-cardinality strings become
+categoricals, integer IDs are downcast and date columns become real
+datetimes. ``table_cache`` applies it to every full-table read, so each
+cached table costs memory in proportion to its unique values rather than
+its rows.
+
+Snapshots persist the compact tables as uncompressed Arrow IPC files, one
+per table. :func:`load_table` memory-maps them and wraps the Arrow buffers
+in a DataFrame without copying, so every session and every worker process
+on the host shares the same read-only pages.
+
+Each file records the table's change version (see versions.py), row count
+and largest primary key at the time it was built. With
+``FOODWASTE_SNAPSHOT_DIR`` set, ``table_cache`` serves a table from its
+snapshot only while all three still match the database, and reads the table
+itself otherwise. Rebuild the snapshot after bulk loads (``loader.py`` does
+this itself when the variable is set).
+
+Usage:
+    python snapshot.py build [--url URL] [--dir snapshots]
+
+Needs pyarrow.
+"""
+import argparse
+import json
+import os
+
+import pandas as pd
+
+import db
+import metrics
+import schema
+import versions
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional: only needed for snapshot files
+    pa = None
+
+CATEGORICAL_COLUMNS = {
+    "providers": ["Type", "City"],
+    "receivers": ["Type", "City"],
+    "food_listings": ["Food_Name", "Provider_Type", "Location", "Food_Type", "Meal_Type"],
+    "claims": ["Status"],
+}
+
+INTEGER_COLUMNS = {
+    "providers": ["Provider_ID"],
+    "receivers": ["Receiver_ID"],
+    "food_listings": ["Food_ID", "Quantity", "Provider_ID"],
+    "claims": ["Claim_ID", "Food_ID", "Receiver_ID"],
+}
+
+DATETIME_COLUMNS = {
+    "food_listings": ["Expiry_Date"],
+    "claims": ["Timestamp"],
+}
+
+
+def snapshot_dir():
+    return os.environ.get("FOODWASTE_SNAPSHOT_DIR")
+
+
+def compact(df, table):
+    """Return ``df`` with categorical strings, downcast integers and datetime columns."""
+    df = df.copy()
+    for column in CATEGORICAL_COLUMNS.get(table, []):
+        if column in df:
+            df[column] = df[column].astype("category")
+    for column in INTEGER_COLUMNS.get(table, []):
+        if column in df and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+    for column in DATETIME_COLUMNS.get(table, []):
+        if column in df:
+            df[column] = pd.to_datetime(df[column], errors="coerce")
+    return df
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("snapshots need pyarrow: pip install pyarrow")
+
+
+STATE_KEY = b"foodwaste.state"
+
+
+def _path(directory, table):
+    return os.path.join(directory, f"{table}.arrow")
+
+
+def _key(table):
+    return list(schema.metadata.tables[table].primary_key)[0].name
+
+
+def _state(version, rows, max_key):
+    return {"version": int(version), "rows": int(rows),
+            "max_key": None if max_key is None or pd.isna(max_key) else int(max_key)}
+
+
+def state(engine, table):
+    """``table``'s change version, row count and largest primary key, as recorded in snapshots."""
+    version = versions.current(engine).get(table, (0, None))[0]
+    row = metrics.read_sql(f"SELECT COUNT(*) AS n, MAX({_key(table)}) AS max_key FROM {table}", engine,
+                           view_name="snapshot state").iloc[0]
+    return _state(version, row["n"], row["max_key"])
+
+
+def build(engine, directory):
+    """Write a compact Arrow snapshot of every table to ``directory``."""
+    _require_pyarrow()
+    os.makedirs(directory, exist_ok=True)
+    sizes = {}
+    for table in schema.TABLES:
+        # Read the version first: a write landing before the rows are read then
+        # leaves the snapshot one version behind, so it is never trusted.
+        version = versions.current(engine).get(table.name, (0, None))[0]
+        df = compact(metrics.read_sql(f"SELECT * FROM {table.name}", engine, view_name="snapshot"),
+                     table.name)
+        recorded = _state(version, len(df), df[_key(table.name)].max() if len(df) else None)
+        arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+        arrow_table = arrow_table.replace_schema_metadata(
+            {**(arrow_table.schema.metadata or {}), STATE_KEY: json.dumps(recorded).encode()})
+        path = _path(directory, table.name)
+        tmp = f"{path}.tmp"
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        os.replace(tmp, path)
+        sizes[table.name] = os.path.getsize(path)
+    return sizes
+
+
+def load_table(directory, table, expected=None):
+    """Memory-map ``table``'s snapshot as a read-only DataFrame.
+
+    Returns None if there is no snapshot, or if ``expected`` (see :func:`state`)
+    is given and differs from the state the snapshot was built at.
+    """
+    _require_pyarrow()
+    path = _path(directory, table)
+    if not os.path.exists(path):
+        return None
+    reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+    if expected is not None:
+        recorded = (reader.schema.metadata or {}).get(STATE_KEY)
+        if recorded is None or json.loads(recorded) != expected:
+            return None
+    arrow_table = reader.read_all()
+    # ArrowDtype columns keep pointing at the mapped buffers instead of copying them.
+    return arrow_table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build compact Arrow snapshots of the tables.")
+    parser.add_argument("command", choices=("build",))
+    parser.add_argument("--url", help="SQLAlchemy database URL (default: the backend configured in db.py)")
+    parser.add_argument("--dir", default=snapshot_dir() or "snapshots", help="output directory")
+    args = parser.parse_args(argv)
+
+    for table, size in build(db.create_db_engine(args.url), args.dir).items():
+        print(f"{table}: {size / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
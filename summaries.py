@@ -0,0 +1,439 @@
+"""Materialized aggregates behind the "15 Queries" tab.
+
+Each summary table holds running counts keyed by one dimension (city,
+provider, receiver, food type, ...). ``crud.py`` calls :func:`apply` inside
+the same transaction as every write, so the counts move with the data and
+the catalog can read a handful of pre-aggregated rows instead of scanning
+and joining claims and food_listings. See ``query_catalog.SUMMARY_QUERIES``.
+
+Counts that come from a claim joined to its listing (claims per food name,
+meal type and location, completed claims per provider and receiver) only
+include claims whose listing exists, exactly like the JOINs they replace.
+Those counts depend on every claim of a listing, so on MySQL and PostgreSQL
+the listing row is locked (``FOR UPDATE``) before its claims are read.
+Quantities are summed and averaged over non-NULL values only, like SUM and
+AVG; the ``Quantified_*`` counters count those values. Run ``rebuild`` after
+upgrading from a version without them.
+
+Claims take their Quantity off the listing (see matching.py), so a
+provider's donated Quantity is its listings' Quantity plus what their
+claims hold, counted with the joined claim counts.
+
+Usage:
+    python summaries.py rebuild [--url URL]   # recompute everything from the base tables
+    python summaries.py verify [--url URL]    # compare with the original catalog queries
+"""
+import argparse
+import collections
+import re
+import sys
+
+import pandas as pd
+from sqlalchemy import Column, Integer, MetaData, String, Table, bindparam, inspect, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+import db
+import metrics
+
+metadata = MetaData()
+
+
+def _summary(name, key, key_type, *counters):
+    return Table(
+        name,
+        metadata,
+        Column(key, key_type, primary_key=True),
+        *(Column(c, Integer, nullable=False, default=0, server_default=text("0")) for c in counters),
+    )
+
+
+summary_city = _summary("summary_city", "City", String(128), "Providers", "Receivers")
+summary_provider_type = _summary("summary_provider_type", "Provider_Type", String(64), "Listings")
+summary_provider = _summary("summary_provider", "Provider_ID", Integer,
+                            "Listings", "Quantity", "Quantified_Listings", "Completed_Claims")
+summary_receiver = _summary("summary_receiver", "Receiver_ID", Integer,
+                            "Claims", "Completed_Claims", "Completed_Quantity", "Quantified_Claims")
+summary_location = _summary("summary_location", "Location", String(128), "Listings", "Claims")
+summary_food_type = _summary("summary_food_type", "Food_Type", String(64), "Listings", "Unclaimed")
+summary_food_name = _summary("summary_food_name", "Food_Name", String(128), "Claims")
+summary_meal_type = _summary("summary_meal_type", "Meal_Type", String(64), "Claims")
+summary_status = _summary("summary_status", "Status", String(16), "Claims")
+summary_totals = _summary("summary_totals", "Metric", String(32), "Value")
+
+# Full recomputation, one INSERT ... SELECT per summary table.
+REBUILD_SQL = {
+    "summary_city": """
+        INSERT INTO summary_city (City, Providers, Receivers)
+        SELECT City, SUM(Providers), SUM(Receivers) FROM (
+            SELECT City, COUNT(*) AS Providers, 0 AS Receivers FROM providers
+            WHERE City IS NOT NULL GROUP BY City
+            UNION ALL
+            SELECT City, 0, COUNT(*) FROM receivers WHERE City IS NOT NULL GROUP BY City
+        ) t GROUP BY City
+    """,
+    "summary_provider_type": """
+        INSERT INTO summary_provider_type (Provider_Type, Listings)
+        SELECT Provider_Type, COUNT(*) FROM food_listings
+        WHERE Provider_Type IS NOT NULL GROUP BY Provider_Type
+    """,
+    "summary_provider": """
+        INSERT INTO summary_provider (Provider_ID, Listings, Quantity, Quantified_Listings, Completed_Claims)
+        SELECT Provider_ID, SUM(Listings), SUM(Quantity), SUM(Quantified_Listings), SUM(Completed_Claims) FROM (
+            SELECT Provider_ID, COUNT(*) AS Listings, COALESCE(SUM(Quantity), 0) AS Quantity,
+                   COUNT(Quantity) AS Quantified_Listings, 0 AS Completed_Claims
+            FROM food_listings WHERE Provider_ID IS NOT NULL GROUP BY Provider_ID
+            UNION ALL
+            SELECT f.Provider_ID, 0, 0, 0, COUNT(*) FROM claims c
+            JOIN food_listings f ON c.Food_ID = f.Food_ID
+            WHERE c.Status = 'Completed' AND f.Provider_ID IS NOT NULL GROUP BY f.Provider_ID
+            UNION ALL
+            SELECT f.Provider_ID, 0, SUM(c.Quantity), 0, 0 FROM claims c
+            JOIN food_listings f ON c.Food_ID = f.Food_ID
+            WHERE c.Quantity IS NOT NULL AND (c.Status IS NULL OR c.Status <> 'Cancelled')
+              AND f.Quantity IS NOT NULL AND f.Provider_ID IS NOT NULL GROUP BY f.Provider_ID
+        ) t GROUP BY Provider_ID
+    """,
+    "summary_receiver": """
+        INSERT INTO summary_receiver (Receiver_ID, Claims, Completed_Claims, Completed_Quantity, Quantified_Claims)
+        SELECT Receiver_ID, SUM(Claims), SUM(Completed_Claims), SUM(Completed_Quantity),
+               SUM(Quantified_Claims) FROM (
+            SELECT Receiver_ID, COUNT(*) AS Claims, 0 AS Completed_Claims, 0 AS Completed_Quantity,
+                   0 AS Quantified_Claims
+            FROM claims WHERE Receiver_ID IS NOT NULL GROUP BY Receiver_ID
+            UNION ALL
+            SELECT c.Receiver_ID, 0, COUNT(*), COALESCE(SUM(COALESCE(c.Quantity, f.Quantity)), 0),
+                   COUNT(COALESCE(c.Quantity, f.Quantity)) FROM claims c
+            JOIN food_listings f ON c.Food_ID = f.Food_ID
+            WHERE c.Status = 'Completed' AND c.Receiver_ID IS NOT NULL GROUP BY c.Receiver_ID
+        ) t GROUP BY Receiver_ID
+    """,
+    "summary_location": """
+        INSERT INTO summary_location (Location, Listings, Claims)
+        SELECT Location, SUM(Listings), SUM(Claims) FROM (
+            SELECT Location, COUNT(*) AS Listings, 0 AS Claims FROM food_listings
+            WHERE Location IS NOT NULL GROUP BY Location
+            UNION ALL
+            SELECT f.Location, 0, COUNT(*) FROM claims c
+            JOIN food_listings f ON c.Food_ID = f.Food_ID
+            WHERE f.Location IS NOT NULL GROUP BY f.Location
+        ) t GROUP BY Location
+    """,
+    "summary_food_type": """
+        INSERT INTO summary_food_type (Food_Type, Listings, Unclaimed)
+        SELECT f.Food_Type, COUNT(*),
+               SUM(CASE WHEN NOT EXISTS (SELECT 1 FROM claims c WHERE c.Food_ID = f.Food_ID)
+                        THEN 1 ELSE 0 END)
+        FROM food_listings f WHERE f.Food_Type IS NOT NULL GROUP BY f.Food_Type
+    """,
+    "summary_food_name": """
+        INSERT INTO summary_food_name (Food_Name, Claims)
+        SELECT f.Food_Name, COUNT(*) FROM claims c JOIN food_listings f ON c.Food_ID = f.Food_ID
+        WHERE f.Food_Name IS NOT NULL GROUP BY f.Food_Name
+    """,
+    "summary_meal_type": """
+        INSERT INTO summary_meal_type (Meal_Type, Claims)
+        SELECT f.Meal_Type, COUNT(*) FROM claims c JOIN food_listings f ON c.Food_ID = f.Food_ID
+        WHERE f.Meal_Type IS NOT NULL GROUP BY f.Meal_Type
+    """,
+    "summary_status": """
+        INSERT INTO summary_status (Status, Claims)
+        SELECT Status, COUNT(*) FROM claims WHERE Status IS NOT NULL GROUP BY Status
+    """,
+    "summary_totals": """
+        INSERT INTO summary_totals (Metric, Value)
+        SELECT 'Quantity', COALESCE(SUM(Quantity), 0) FROM food_listings
+    """,
+}
+
+_enabled = {}
+
+
+def enabled(engine):
+    """Whether the summary tables exist with all their columns.
+
+    Only a yes is kept (per engine and process), so a process started before
+    ``python summaries.py rebuild`` starts maintaining the tables once it has run.
+    """
+    key = str(engine.url)
+    if not _enabled.get(key):
+        inspector = inspect(engine)
+        _enabled[key] = all(
+            inspector.has_table(t.name)
+            and {c.name for c in t.columns} <= {c["name"] for c in inspector.get_columns(t.name)}
+            for t in metadata.tables.values()
+        )
+    return _enabled[key]
+
+
+def rebuild(engine):
+    """Recreate every summary table from the base tables in one transaction.
+
+    The time rollups (see rollups.py) are rebuilt as well.
+    """
+    # Dropped first, so tables from an older layout get their new counters.
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            metrics.execute(conn, table.delete())
+            metrics.execute(conn, REBUILD_SQL[table.name])
+    _enabled[str(engine.url)] = True
+    _rollups().rebuild(engine)
+
+
+class Deltas:
+    """Collects counter changes so each summary row is written once per write.
+
+    Keys are a value, or a tuple for tables with a composite primary key.
+    Rows that change the same counters are written with one executemany.
+    """
+
+    def __init__(self):
+        self.rows = collections.defaultdict(collections.Counter)
+
+    def add(self, table, key, **counters):
+        if key is None:
+            return
+        self.rows[(table, key)].update(counters)
+
+    def flush(self, conn):
+        batches = collections.defaultdict(list)
+        for (table, key), counters in self.rows.items():
+            counters = {c: v for c, v in counters.items() if v}
+            if counters:
+                key_cols = [c.name for c in table.primary_key]
+                keys = key if isinstance(key, tuple) else (key,)
+                params = {**counters, **{f"key_{c}": v for c, v in zip(key_cols, keys)}}
+                batches[(table, tuple(sorted(counters)))].append(params)
+        for (table, counters), params in batches.items():
+            metrics.execute(conn, bump_statement(conn, table, counters),
+                            params if len(params) > 1 else params[0])
+
+
+def bump_statement(conn, table, counters):
+    """``INSERT ... ON DUPLICATE KEY / ON CONFLICT`` adding ``counters`` to a row."""
+    key_cols = [c.name for c in table.primary_key]
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        stmt = stmt.on_duplicate_key_update({c: table.c[c] + stmt.inserted[c] for c in counters})
+    elif dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_cols,
+            set_={c: table.c[c] + stmt.excluded[c] for c in counters},
+        )
+    else:
+        raise ValueError(f"summary tables are not supported for the {dialect} dialect")
+    return stmt.values({
+        **{c: bindparam(f"key_{c}") for c in key_cols},
+        **{c: bindparam(c) for c in counters},
+    })
+
+
+def _for_update(conn, lock):
+    # SQLite has one writer at a time, so only the server backends need row locks.
+    return " FOR UPDATE" if lock and conn.dialect.name in ("mysql", "postgresql") else ""
+
+
+def fetch_listing(conn, food_id, lock=False):
+    if food_id is None:
+        return None
+    return metrics.execute(
+        conn, f"SELECT * FROM food_listings WHERE Food_ID = :fid{_for_update(conn, lock)}", {"fid": food_id}
+    ).mappings().first()
+
+
+def claims_of(conn, food_id, exclude_claim_id=None, lock=False):
+    """Claims on a listing; with ``lock``, a locking read that sees the latest committed rows."""
+    return metrics.execute(
+        conn, f"SELECT * FROM claims WHERE Food_ID = :fid AND Claim_ID <> :cid{_for_update(conn, lock)}",
+        {"fid": food_id, "cid": exclude_claim_id if exclude_claim_id is not None else -1},
+    ).mappings().all()
+
+
+def _claimed(claim, listing):
+    # Claims made before quantities were recorded count the listing's quantity.
+    return claim["Quantity"] if claim.get("Quantity") is not None else listing["Quantity"]
+
+
+def _held(claim):
+    # What the claim keeps off its listing, like matching.holds.
+    return claim["Quantity"] if claim.get("Quantity") is not None and claim["Status"] != "Cancelled" else 0
+
+
+def _joined_claim(deltas, claim, listing, sign):
+    """Counts that come from a claim joined to its listing."""
+    if listing["Quantity"] is not None:
+        deltas.add(summary_provider, listing["Provider_ID"], Quantity=sign * _held(claim))
+    deltas.add(summary_food_name, listing["Food_Name"], Claims=sign)
+    deltas.add(summary_meal_type, listing["Meal_Type"], Claims=sign)
+    deltas.add(summary_location, listing["Location"], Claims=sign)
+    if claim["Status"] == "Completed":
+        deltas.add(summary_provider, listing["Provider_ID"], Completed_Claims=sign)
+        deltas.add(summary_receiver, claim["Receiver_ID"], Completed_Claims=sign,
+                   Completed_Quantity=sign * (_claimed(claim, listing) or 0),
+                   Quantified_Claims=sign * (_claimed(claim, listing) is not None))
+
+
+def _listing_delta(conn, deltas, listing, sign):
+    quantity = listing["Quantity"] or 0
+    deltas.add(summary_provider_type, listing["Provider_Type"], Listings=sign)
+    deltas.add(summary_provider, listing["Provider_ID"], Listings=sign, Quantity=sign * quantity,
+               Quantified_Listings=sign * (listing["Quantity"] is not None))
+    deltas.add(summary_location, listing["Location"], Listings=sign)
+    deltas.add(summary_food_type, listing["Food_Type"], Listings=sign)
+    deltas.add(summary_totals, "Quantity", Value=sign * quantity)
+    # No claim on the listing can come or go while its row is locked.
+    if _for_update(conn, True):
+        fetch_listing(conn, listing["Food_ID"], lock=True)
+    claims = claims_of(conn, listing["Food_ID"], lock=True)
+    if not claims:
+        deltas.add(summary_food_type, listing["Food_Type"], Unclaimed=sign)
+    for claim in claims:
+        _joined_claim(deltas, claim, listing, sign)
+
+
+def _claim_delta(conn, deltas, claim, sign):
+    deltas.add(summary_status, claim["Status"], Claims=sign)
+    deltas.add(summary_receiver, claim["Receiver_ID"], Claims=sign)
+    listing = fetch_listing(conn, claim["Food_ID"], lock=True)
+    if listing is None:
+        return
+    _joined_claim(deltas, claim, listing, sign)
+    # The first claim on a listing takes it out of "unclaimed"; removing the
+    # last one puts it back.
+    if not claims_of(conn, claim["Food_ID"], exclude_claim_id=claim["Claim_ID"], lock=True):
+        deltas.add(summary_food_type, listing["Food_Type"], Unclaimed=-sign)
+
+
+def apply(conn, table, old, new):
+    """Update the summaries for one row of ``table`` changing from ``old`` to ``new``.
+
+    ``old`` is None for an insert and ``new`` is None for a delete. Must be
+    called inside the write's transaction, after the base table was changed.
+    """
+    deltas = Deltas()
+    if table in ("providers", "receivers"):
+        counter = "Providers" if table == "providers" else "Receivers"
+        if old is not None:
+            deltas.add(summary_city, old["City"], **{counter: -1})
+        if new is not None:
+            deltas.add(summary_city, new["City"], **{counter: 1})
+    elif table == "food_listings":
+        if old is not None:
+            _listing_delta(conn, deltas, old, -1)
+        if new is not None:
+            _listing_delta(conn, deltas, new, 1)
+    elif table == "claims":
+        if old is not None:
+            _claim_delta(conn, deltas, old, -1)
+        if new is not None:
+            _claim_delta(conn, deltas, new, 1)
+    _rollups().add_deltas(conn, deltas, table, old, new)
+    deltas.flush(conn)
+
+
+def _batch_delta(conn, deltas, table, rows, food_ids, sign):
+    if table in ("providers", "receivers"):
+        counter = "Providers" if table == "providers" else "Receivers"
+        for row in rows:
+            deltas.add(summary_city, row["City"], **{counter: sign})
+    elif table == "food_listings":
+        for row in rows:
+            _listing_delta(conn, deltas, row, sign)
+    elif table == "claims":
+        for row in rows:
+            deltas.add(summary_status, row["Status"], Claims=sign)
+            deltas.add(summary_receiver, row["Receiver_ID"], Claims=sign)
+        # Whole listings, with all their claims, so "unclaimed" comes out right
+        # when several claims on one listing change together.
+        for food_id in sorted(food_ids):
+            listing = fetch_listing(conn, food_id, lock=True)
+            if listing is not None:
+                _listing_delta(conn, deltas, listing, sign)
+
+
+def apply_batch(conn, table, old_rows, values, write, archived=False):
+    """Update the summaries around a multi-row write to ``table``.
+
+    ``old_rows`` are the affected rows before the write (none for inserts) and
+    ``values`` the column values being written. ``write()`` changes the base
+    table and returns ``(result, new_rows)``; ``result`` is passed back.
+    With ``archived`` the rows are moving to the archive tables (see
+    archive.py); the time rollups count history, so they are left as they are.
+    Must be called inside the write's transaction.
+    """
+    food_ids = set()
+    if table == "claims":
+        food_ids = {r["Food_ID"] for r in [*old_rows, *values] if r.get("Food_ID") is not None}
+    deltas = Deltas()
+    _batch_delta(conn, deltas, table, old_rows, food_ids, -1)
+    if not archived:
+        _rollups().add_batch_deltas(conn, deltas, table, old_rows, -1)
+    result, new_rows = write()
+    _batch_delta(conn, deltas, table, new_rows, food_ids, 1)
+    if not archived:
+        _rollups().add_batch_deltas(conn, deltas, table, new_rows, 1)
+    deltas.flush(conn)
+    return result
+
+
+def _rollups():
+    # rollups.py builds on this module, so it is imported late.
+    import rollups
+
+    return rollups
+
+
+def verify(engine):
+    """Compare every summary-backed query with the original; return mismatched names."""
+    import query_catalog
+
+    # LIMIT is dropped on both sides: rows tied at the cut-off may legitimately differ.
+    unlimited = lambda sql: text(re.sub(r"\s+LIMIT\s+\d+", "", sql))
+    mismatched = []
+    for name, summary_sql in query_catalog.SUMMARY_QUERIES.items():
+        expected = metrics.read_sql(unlimited(query_catalog.QUERIES[name]), engine)
+        actual = metrics.read_sql(unlimited(summary_sql), engine)
+        if not _same_rows(expected, actual):
+            mismatched.append(name)
+    return mismatched
+
+
+def _same_rows(a, b):
+    if a.shape != b.shape:
+        return False
+    a, b = a.copy(), b.copy()
+    b.columns = a.columns
+    for col in a.columns:
+        if pd.api.types.is_numeric_dtype(a[col]) or pd.api.types.is_numeric_dtype(b[col]):
+            a[col] = pd.to_numeric(a[col]).astype(float).round(4)
+            b[col] = pd.to_numeric(b[col]).astype(float).round(4)
+        else:
+            a[col], b[col] = a[col].astype(str), b[col].astype(str)
+    key = list(a.columns)
+    return a.sort_values(key).reset_index(drop=True).equals(b.sort_values(key).reset_index(drop=True))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the analytics summary tables.")
+    parser.add_argument("command", choices=("rebuild", "verify"))
+    parser.add_argument("--url", help="SQLAlchemy database URL (default: the backend configured in db.py)")
+    args = parser.parse_args(argv)
+
+    engine = db.create_db_engine(args.url)
+    if args.command == "rebuild":
+        rebuild(engine)
+        print("summary tables rebuilt")
+        return
+    mismatched = verify(engine)
+    for name in mismatched:
+        print(f"MISMATCH {name}")
+    if mismatched:
+        sys.exit(1)
+    print("summary tables match the base tables")
+
+
+if __name__ == "__main__":
+    main()
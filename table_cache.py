@@ -0,0 +1,154 @@
+"""Process-wide cache for the table reads made by app.py.
+
+Streamlit re-executes app.py on every interaction, but imported modules are
+only loaded once per server process, so the cache below is shared by every
+session. Each entry remembers which tables it was built from; a write to a
+table evicts just the entries that depend on it.
+
+Writes made by other processes (another Streamlit worker, the loader, the
+archive sweeper) are picked up through the change versions in versions.py:
+before a read, the tables' versions are compared with the ones seen last,
+at most once every ``FOODWASTE_CACHE_VERSION_CHECK`` seconds (default 1),
+and a changed table is evicted. Entries also expire after
+``FOODWASTE_CACHE_TTL`` seconds (default 300) as a backstop for writes that
+bypass the versions, e.g. plain SQL.
+
+Cached DataFrames are shared between sessions and must be treated as
+read-only by callers.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import snapshot
+import versions
+
+
+class TableCache:
+    def __init__(self, ttl=None, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key, tables, loader):
+        """Return the cached value for ``key``, calling ``loader()`` on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, _, loaded_at = entry
+                if self.ttl is None or now - loaded_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            generations = {t: self._generations.get(t, 0) for t in tables}
+
+        value = loader()
+
+        with self._lock:
+            # A write that landed while we were loading makes this result stale;
+            # hand it to the caller but do not keep it.
+            if any(self._generations.get(t, 0) != g for t, g in generations.items()):
+                return value
+            self._entries[key] = (value, frozenset(tables), time.monotonic())
+            self._entries.move_to_end(key)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, table):
+        """Drop every entry that was built from ``table``."""
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [k for k, (_, tables, _) in self._entries.items() if table in tables]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            for table in self._generations:
+                self._generations[table] += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def _env_float(name, default=None):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+cache = TableCache(
+    ttl=_env_float("FOODWASTE_CACHE_TTL", 300.0),
+    max_entries=int(os.environ.get("FOODWASTE_CACHE_MAX_ENTRIES", "64")),
+)
+
+VERSION_CHECK = _env_float("FOODWASTE_CACHE_VERSION_CHECK", 1.0)
+
+_seen = {}  # (engine url, table) -> last version seen
+_seen_lock = threading.Lock()
+
+
+def _sync(engine, tables):
+    """Evict ``tables`` that another process changed since they were last seen."""
+    current = versions.current(engine, VERSION_CHECK)
+    url = str(engine.url)
+    with _seen_lock:
+        changed = []
+        for table in tables:
+            version = current.get(table, (0, None))[0]
+            previous = _seen.get((url, table))
+            _seen[(url, table)] = version
+            if previous is not None and previous != version:
+                changed.append(table)
+    for table in changed:
+        cache.invalidate(table)
+
+
+def read_sql(engine, sql, tables, params=None):
+    """Cached ``metrics.read_sql`` for a query that only depends on ``tables``."""
+    _sync(engine, tables)
+    key = (str(engine.url), sql, tuple(sorted((params or {}).items())))
+    return cache.get_or_load(key, tables, lambda: metrics.read_sql(sql, engine, params=params))
+
+
+def read_table(engine, table):
+    """Full table in compact form (see snapshot.py), cached until the table is written."""
+    _sync(engine, (table,))
+    sql = f"SELECT * FROM {table}"
+
+    def load():
+        directory = snapshot.snapshot_dir()
+        if directory:
+            frame = snapshot.load_table(directory, table, snapshot.state(engine, table))
+            if frame is not None:
+                return frame
+        return snapshot.compact(metrics.read_sql(sql, engine), table)
+
+    return cache.get_or_load((str(engine.url), sql, ()), (table,), load)
+
+
+def invalidate(table):
+    cache.invalidate(table)
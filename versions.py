@@ -0,0 +1,105 @@
+"""Per-table change versions shared by every process using the database.
+
+``table_versions`` holds one row per base table with a counter and the time
+of the last change. crud.py and matching.py call :func:`bump` after each
+committed write (next to the table cache eviction), so a reader in another
+process, such as the HTTP API, can tell whether a table changed without
+reading it. The table is created on first use.
+
+Each table's search index (see search.py) has a row of its own, bumped only
+when indexed text changes, so stock updates do not make other processes
+rebuild their indexes.
+
+:func:`current` reads every version in one small query and caches the
+answer for ``max_age`` seconds, so frequent polls cost no database work.
+"""
+import datetime
+import threading
+import time
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, bindparam, text
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+import schema
+
+metadata = MetaData()
+
+table_versions = Table(
+    "table_versions",
+    metadata,
+    Column("Table_Name", String(64), primary_key=True),
+    Column("Version", Integer, nullable=False, default=0, server_default=text("0")),
+    Column("Updated_At", DateTime, nullable=False),
+)
+
+TABLES = [t.name for t in schema.TABLES]
+INDEXES = {t: f"{t}.search" for t in TABLES}
+
+_ready = set()
+_lock = threading.Lock()
+_current = {}  # engine url -> (read at, {table: (version, updated_at)})
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def ensure(engine):
+    """Create ``table_versions`` and its rows if missing (once per engine and process)."""
+    key = str(engine.url)
+    with _lock:
+        if key in _ready:
+            return
+    metadata.create_all(engine)
+    try:
+        with engine.begin() as conn:
+            present = {row[0] for row in metrics.execute(conn, "SELECT Table_Name FROM table_versions")}
+            missing = [{"name": t, "now": _now()} for t in [*TABLES, *INDEXES.values()]
+                       if t not in present]
+            if missing:
+                metrics.execute(conn, "INSERT INTO table_versions (Table_Name, Version, Updated_At) "
+                                      "VALUES (:name, 0, :now)", missing)
+    except IntegrityError:
+        pass  # another process added the rows first
+    with _lock:
+        _ready.add(key)
+
+
+def bump(engine, *tables):
+    """Record that ``tables`` changed."""
+    ensure(engine)
+    sql = text(
+        "UPDATE table_versions SET Version = Version + 1, Updated_At = :now WHERE Table_Name IN :tables"
+    ).bindparams(bindparam("tables", expanding=True))
+    with engine.begin() as conn:
+        metrics.execute(conn, sql, {"now": _now(), "tables": list(tables)}, view_name="versions bump")
+    with _lock:
+        _current.pop(str(engine.url), None)
+
+
+def current(engine, max_age=0.0):
+    """``{table: (version, updated_at)}``, at most ``max_age`` seconds old."""
+    key = str(engine.url)
+    now = time.monotonic()
+    with _lock:
+        cached = _current.get(key)
+        if cached is not None and now - cached[0] < max_age:
+            return cached[1]
+    ensure(engine)
+    frame = metrics.read_sql("SELECT Table_Name, Version, Updated_At FROM table_versions", engine,
+                             view_name="versions")
+    found = {
+        row.Table_Name: (int(row.Version), _datetime(row.Updated_At))
+        for row in frame.itertuples(index=False)
+    }
+    with _lock:
+        _current[key] = (now, found)
+    return found
+
+
+def _datetime(value):
+    # SQLite hands DateTime columns back as text when read through text() SQL.
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value.to_pydatetime() if hasattr(value, "to_pydatetime") else value